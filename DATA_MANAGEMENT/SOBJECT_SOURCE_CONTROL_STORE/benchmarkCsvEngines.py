@@ -0,0 +1,200 @@
+# MIT License
+# Copyright (c) 2023 Andrew Hovey
+# Full License Text: https://ahovey.com/MITLicense.html
+# The above abbreviated copyright notice shall be included in all copies or substantial portions of the Software.
+# -----------------------------------------------------
+
+# https://github.com/ahoveynow/SalesforceUtilities/blob/main/DATA_MANAGEMENT/SOBJECT_SOURCE_CONTROL_STORE
+
+# Benchmarks the csv engines (see csvEngine.py) on the hot conversion paths, and checks that every engine
+# produces identical output:
+#  - convertCsvToSource.extractCsvRecords
+#  - convertSourceToCsv.writeRecordsToCsv
+#  - convertSourceToCsvAndUpsertToOrg.addRecordTypeIds (Record Type ids are pre-cached, so the org isn't queried)
+# The arrow engine is only included when pyarrow is installed. Nothing is sent to an org.
+
+# USAGE:
+# python benchmarkCsvEngines.py
+#	--rows 10000,100000,1000000		(optional, default shown)
+#	--workingFolder __benchmark		(optional, deleted afterwards)
+#	--repeat 3						(optional: each step is timed this many times and the fastest time is reported)
+
+import io
+import os
+import csv
+import json
+import time
+import util
+import shutil
+import hashlib
+import contextlib
+import csvEngine
+import convertCsvToSource
+import convertSourceToCsv
+import convertSourceToCsvAndUpsertToOrg as upsertToOrg
+
+OBJECT_NAME = 'Benchmark_Object__c'
+UPSERT_FIELD = 'Name'
+JSON_FIELD = 'Some_Json_Field__c'
+RECORD_TYPES = ['Type_A', 'Type_B', 'Type_C']
+
+# Params
+rowCounts = [10000, 100000, 1000000]
+workingFolder = '__benchmark'
+repeat = 3
+
+
+######################
+### PROCESS PARAMS ###
+
+def processParams():
+	global rowCounts, workingFolder, repeat
+	params = util.getArgParams()
+
+	# rows
+	rowsParam = ('rows' in params.keys() and params['rows'])
+	if rowsParam:
+		rowCounts = [int(rowCount.strip()) for rowCount in rowsParam.split(',')]
+	print(f'rows: {",".join(str(rowCount) for rowCount in rowCounts)}')
+
+	# workingFolder
+	workingFolderParam = ('workingFolder' in params.keys() and params['workingFolder'])
+	if workingFolderParam:
+		workingFolder = workingFolderParam
+	print(f'workingFolder: {workingFolder}')
+
+	# repeat
+	repeatParam = ('repeat' in params.keys() and params['repeat'])
+	if repeatParam:
+		repeat = int(repeatParam)
+	print(f'repeat: {repeat}')
+
+
+
+#####################
+### GENERATE DATA ###
+
+def generateOrgCsv(filePath, rowCount):
+	# A csv as queried from the org, with the values the conversions special-case (#N/A, null, json, lookups, CRLF line breaks)
+	with open(filePath, 'w', newline='', encoding='utf8') as csvfile:
+		writer = csv.writer(csvfile)
+		writer.writerow([UPSERT_FIELD, 'Some_Field_A__c', 'Some_Field_B__c', JSON_FIELD, 'Related_Record__r.Name', 'RecordType.DeveloperName'])
+		for index in range(rowCount):
+			writer.writerow([
+				f'Record {index}',
+				f'Value {index % 97}',
+				'#N/A' if index % 3 == 0 else ('null' if index % 5 == 0 else (f'Line 1\r\nLine {index}' if index % 7 == 0 else f'Line 1\nLine {index}')), # Long text areas often contain CRLF
+				json.dumps({'index': index, 'values': [index % 7, 'x']}) if index % 2 == 0 else '',
+				f'Related {index % 11}' if index % 4 else '',
+				RECORD_TYPES[index % len(RECORD_TYPES)] if index % 10 else '',
+			])
+
+
+
+##################
+### BENCHMARKS ###
+
+def hashFile(filePath):
+	with open(filePath, 'rb') as fileToRead:
+		return hashlib.sha1(fileToRead.read()).hexdigest()
+
+
+def hashRecords(records):
+	contentHash = hashlib.sha1()
+	for record in records.iterDicts():
+		contentHash.update(json.dumps(record, sort_keys = True).encode('utf8'))
+	return contentHash.hexdigest()
+
+
+def benchmarkExtract(engine, orgCsvPath):
+	convertCsvToSource.processParams({'sourceFile': orgCsvPath, 'destinationFolder': f'{workingFolder}/source', 'upsertField': UPSERT_FIELD, 'objectName': OBJECT_NAME, 'jsonFields': JSON_FIELD, 'csvEngine': engine})
+	startTime = time.perf_counter()
+	convertCsvToSource.extractCsvRecords()
+	return time.perf_counter() - startTime, hashRecords(convertCsvToSource.csvFileRecords)
+
+
+def benchmarkWrite(engine, orgCsvPath):
+	# Build the processed records from the extracted ones (as compileDictFromSource would from the json files)
+	convertCsvToSource.processParams({'sourceFile': orgCsvPath, 'destinationFolder': f'{workingFolder}/source', 'upsertField': UPSERT_FIELD, 'objectName': OBJECT_NAME, 'jsonFields': JSON_FIELD, 'csvEngine': csvEngine.FAST})
+	convertCsvToSource.extractCsvRecords()
+	destinationFile = f'{workingFolder}/{engine}/{OBJECT_NAME}.csv'
+	convertSourceToCsv.processParams({'sourceFolder': f'{workingFolder}/source', 'destinationFile': destinationFile, 'csvEngine': engine})
+	convertSourceToCsv.records = convertSourceToCsv.recordTable.RecordTable()
+	for record in convertCsvToSource.csvFileRecords.iterDicts(includeConstantFields = False):
+		convertSourceToCsv.records.appendRecord(record)
+
+	startTime = time.perf_counter()
+	convertSourceToCsv.writeRecordsToCsv()
+	return time.perf_counter() - startTime, hashFile(destinationFile)
+
+
+def benchmarkRecordTypes(engine):
+	# Runs on the csv written by benchmarkWrite for the same engine
+	upsertToOrg.csvDirectory = f'{workingFolder}/{engine}'
+	upsertToOrg.csvEngineName = engine
+	upsertToOrg.validObjects = {OBJECT_NAME: {'name': OBJECT_NAME, 'upsertField': UPSERT_FIELD}}
+	upsertToOrg.objectRecords = {OBJECT_NAME: []}
+	upsertToOrg.recordTypeIdsByOrg[upsertToOrg.orgAlias] = {f'{OBJECT_NAME}.{recordType}'.lower(): f'012000000000{index:03d}AAA' for index, recordType in enumerate(RECORD_TYPES)}
+
+	startTime = time.perf_counter()
+	upsertToOrg.addRecordTypeIds(upsertToOrg.orgAlias, upsertToOrg.csvDirectory)
+	return time.perf_counter() - startTime, hashFile(f'{workingFolder}/{engine}/{OBJECT_NAME}.csv')
+
+
+def fastest(benchmark, setup = None):
+	# Returns (fastest time, output hash) over the repeated runs
+	timings = []
+	with contextlib.redirect_stdout(io.StringIO()): # The scripts print their params on every run
+		for attempt in range(repeat):
+			if setup and attempt > 0:
+				setup() # eg. addRecordTypeIds rewrites its csv, so the csv is regenerated before every run
+			timing, outputHash = benchmark()
+			timings.append(timing)
+	return min(timings), outputHash
+
+
+def runBenchmarks(rowCount):
+	os.makedirs(workingFolder, exist_ok=True)
+	orgCsvPath = f'{workingFolder}/{OBJECT_NAME}_from_org.csv'
+	generateOrgCsv(orgCsvPath, rowCount)
+
+	engines = [engine for engine in csvEngine.ENGINES if csvEngine.validateEngine(engine) is None]
+	results = {}
+	for engine in engines:
+		os.makedirs(f'{workingFolder}/{engine}', exist_ok=True)
+		results[engine] = {
+			'extractCsvRecords': fastest(lambda: benchmarkExtract(engine, orgCsvPath)),
+			'writeRecordsToCsv': fastest(lambda: benchmarkWrite(engine, orgCsvPath)),
+			'addRecordTypeIds': fastest(lambda: benchmarkRecordTypes(engine), lambda: benchmarkWrite(engine, orgCsvPath)),
+		}
+
+	print(f'\n=== {rowCount} rows ===')
+	print(f'{"":<20}' + ''.join(f'{engine:>12}' for engine in engines) + '   identical')
+	for stepName in ['extractCsvRecords', 'writeRecordsToCsv', 'addRecordTypeIds']:
+		outputHashes = set(results[engine][stepName][1] for engine in engines)
+		print(f'{stepName:<20}' + ''.join(f'{results[engine][stepName][0]:>11.2f}s' for engine in engines) + f'   {"yes" if len(outputHashes) == 1 else "NO"}')
+	return all(len(set(results[engine][stepName][1] for engine in engines)) == 1 for stepName in results[engines[0]])
+
+
+
+###############
+### EXECUTE ###
+
+def execute():
+	processParams()
+	if csvEngine.validateEngine(csvEngine.ARROW):
+		print('pyarrow is not installed. The arrow engine will not be benchmarked.')
+
+	allIdentical = True
+	try:
+		for rowCount in rowCounts:
+			allIdentical = runBenchmarks(rowCount) and allIdentical
+	finally:
+		shutil.rmtree(workingFolder, ignore_errors=True)
+
+	if not allIdentical:
+		util.exitWithFailure('The csv engines produced different output.')
+
+
+if __name__ == '__main__':
+	execute()
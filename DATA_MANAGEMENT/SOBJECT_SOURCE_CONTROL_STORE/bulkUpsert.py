@@ -0,0 +1,183 @@
+# MIT License
+# Copyright (c) 2023 Andrew Hovey
+# Full License Text: https://ahovey.com/MITLicense.html
+# The above abbreviated copyright notice shall be included in all copies or substantial portions of the Software.
+# -----------------------------------------------------
+
+# https://github.com/ahoveynow/SalesforceUtilities/blob/main/DATA_MANAGEMENT/SOBJECT_SOURCE_CONTROL_STORE
+
+# Runs a bulk upsert and returns the result of every row in the csv.
+# sfdx only reports batch totals, so the per-row results are downloaded from the Bulk API
+# (GET /services/async/{version}/job/{jobId}/batch/{batchId}/result), which returns one result per row, in csv order.
+# Batches are created in csv order, but not always with the same number of rows (sfdx also starts a new batch at
+# about 10 MB), so each batch's rows are counted from its own numberRecordsProcessed.
+
+import util
+import csv
+import io
+import json
+import re
+import urllib.error
+import urllib.request
+
+# Row statuses
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'			# The org rejected the row. Safe to retry, though only transient errors (see isTransientError) are worth it.
+PENDING = 'pending'			# The row's batch was still queued or running when sfdx stopped waiting. Retrying could send it twice.
+UNKNOWN = 'unknown'			# The row couldn't be matched with a result (eg. the batch row counts don't add up to the csv row count)
+DEFAULT_API_VERSION = '57.0'
+
+# Errors that can succeed when the row is sent again (eg. another job held a lock on the record).
+# Other errors (eg. REQUIRED_FIELD_MISSING, DUPLICATE_VALUE, INVALID_FIELD) fail the same way every time.
+TRANSIENT_ERROR_CODES = ['UNABLE_TO_LOCK_ROW', 'REQUEST_RUNNING_TOO_LONG', 'SERVER_UNAVAILABLE', 'QUERY_TIMEOUT', 'TOO_MANY_APEX_REQUESTS']
+
+orgSessions = {}			# orgAlias -> {'accessToken', 'instanceUrl', 'apiVersion'}. Looked up again once the session expires.
+
+
+####################
+### ORG SESSIONS ###
+
+def getOrgSession(sfdxCommand, orgAlias):
+	if orgAlias in orgSessions:
+		return orgSessions[orgAlias]
+
+	displayResult = util.runJsonCommand([sfdxCommand, 'force:org:display', '-u', orgAlias])
+	if not displayResult or displayResult.get('status') != 0:
+		return None
+	result = displayResult['result']
+	orgSessions[orgAlias] = {
+		'accessToken': result['accessToken'],
+		'instanceUrl': result['instanceUrl'].rstrip('/'),
+		'apiVersion': result.get('apiVersion') or DEFAULT_API_VERSION,
+	}
+	return orgSessions[orgAlias]
+
+
+def isExpiredSessionError(httpError):
+	# The Bulk API answers an expired session with 401, or with 400 and an InvalidSessionId exception code
+	if httpError.code == 401:
+		return True
+	try:
+		return 'InvalidSessionId' in httpError.read().decode('utf8', errors = 'replace')
+	except Exception:
+		return False
+
+
+
+###################
+### BULK UPSERT ###
+
+def upsertCsv(sfdxCommand, orgAlias, objectName, upsertField, csvFilePath, rowCount):
+	# Returns a list with one (status, error) tuple per csv row
+	command = [sfdxCommand, 'force:data:bulk:upsert']
+	command.extend(['-u', orgAlias])
+	command.extend(['-i', upsertField])
+	command.extend(['-f', csvFilePath])
+	command.extend(['-s', objectName])
+	command.extend(['-w', '10'])
+	print(command)
+	upsertResult = util.runJsonCommand(command)
+
+	batchInfos = findBatchInfos(upsertResult)
+	if not batchInfos:
+		if upsertResult is None:
+			return [(UNKNOWN, 'The sfdx output could not be read, so the bulk job may have been created. Check the org before upserting these rows again.')] * rowCount
+		message = upsertResult.get('message') or 'The bulk job did not return any batch results.'
+		if hasJobId(upsertResult):
+			# eg. sfdx stopped waiting (-w) after creating the job, which may still upsert these rows
+			return [(UNKNOWN, f'{message} Check the job in the org before upserting these rows again.')] * rowCount
+		return [(FAILED, message)] * rowCount # No job was created
+
+	batchRowCounts = getBatchRowCounts(batchInfos, rowCount)
+	if batchRowCounts is None:
+		return [(UNKNOWN, f'The row counts of the {len(batchInfos)} batch(es) do not add up to the {rowCount} csv rows, so rows could not be matched with their results.')] * rowCount
+
+	rowResults = []
+	for batchInfo, batchRowCount in zip(batchInfos, batchRowCounts):
+		rowResults.extend(getBatchRowResults(sfdxCommand, orgAlias, batchInfo, batchRowCount))
+	return rowResults
+
+
+def getBatchRowCounts(batchInfos, rowCount):
+	# Completed batches report how many rows they had. The rows of a batch that didn't complete can only be
+	# counted when it is the only one, from the rows left over. Returns None when the rows can't be matched.
+	batchRowCounts = []
+	unknownCountIndexes = []
+	for index, batchInfo in enumerate(batchInfos):
+		if batchInfo.get('state') == 'Completed':
+			batchRowCounts.append(int(batchInfo.get('numberRecordsProcessed') or 0))
+		else:
+			batchRowCounts.append(None)
+			unknownCountIndexes.append(index)
+
+	knownRowCount = sum(batchRowCount for batchRowCount in batchRowCounts if batchRowCount is not None)
+	if len(unknownCountIndexes) == 1 and knownRowCount <= rowCount:
+		batchRowCounts[unknownCountIndexes[0]] = rowCount - knownRowCount
+	elif unknownCountIndexes or knownRowCount != rowCount:
+		return None
+	return batchRowCounts
+
+
+def findBatchInfos(upsertResult):
+	# The batch infos are in 'result' (or 'data' when the command exits with a failure)
+	if not upsertResult:
+		return []
+	for key in ('result', 'data'):
+		batchInfos = upsertResult.get(key)
+		if isinstance(batchInfos, dict):
+			batchInfos = [batchInfos]
+		if isinstance(batchInfos, list) and batchInfos and isinstance(batchInfos[0], dict) and 'jobId' in batchInfos[0]:
+			return batchInfos
+	return []
+
+
+def hasJobId(upsertResult):
+	# Bulk job ids start with 750. They appear as a jobId value, or in the message when sfdx stops waiting.
+	upsertResultText = json.dumps(upsertResult)
+	return '"jobId"' in upsertResultText or re.search(r'\b750[0-9A-Za-z]{12}(?:[0-9A-Za-z]{3})?\b', upsertResultText) is not None
+
+
+def isTransientError(error):
+	return any(errorCode in (error or '') for errorCode in TRANSIENT_ERROR_CODES)
+
+
+def getBatchRowResults(sfdxCommand, orgAlias, batchInfo, batchRowCount):
+	if batchInfo.get('state') in ('Queued', 'InProgress'):
+		return [(PENDING, f'Batch {batchInfo.get("id")} of job {batchInfo.get("jobId")} was still {batchInfo.get("state")} when sfdx stopped waiting. Check the job in the org before upserting these rows again.')] * batchRowCount
+	if batchInfo.get('state') != 'Completed':
+		return [(FAILED, batchInfo.get('stateMessage') or f'Batch {batchInfo.get("state")}.')] * batchRowCount # eg. Failed or Not Processed
+	if int(batchInfo.get('numberRecordsFailed') or 0) == 0:
+		return [(SUCCEEDED, '')] * batchRowCount # No need to download results when every row succeeded
+
+	try:
+		resultCsv = downloadBatchResult(sfdxCommand, orgAlias, batchInfo)
+	except Exception as exception:
+		return [(UNKNOWN, f'Could not download batch results: {exception}')] * batchRowCount
+	if resultCsv is None:
+		return [(UNKNOWN, 'Could not download batch results (org session unavailable).')] * batchRowCount
+
+	rowResults = []
+	for resultRow in csv.DictReader(io.StringIO(resultCsv)):
+		rowResults.append((SUCCEEDED, '') if resultRow.get('Success', '').lower() == 'true' else (FAILED, resultRow.get('Error', '')))
+	if len(rowResults) != batchRowCount:
+		return [(UNKNOWN, f'Batch {batchInfo["id"]} returned {len(rowResults)} result(s) for {batchRowCount} row(s).')] * batchRowCount
+	return rowResults
+
+
+def downloadBatchResult(sfdxCommand, orgAlias, batchInfo):
+	# Returns the batch's result csv, or None if there is no org session.
+	# A long-running process (eg. watch mode) outlives the session, so an expired session is looked up again once.
+	for attempt in (1, 2):
+		session = getOrgSession(sfdxCommand, orgAlias)
+		if not session:
+			return None
+		url = f"{session['instanceUrl']}/services/async/{session['apiVersion']}/job/{batchInfo['jobId']}/batch/{batchInfo['id']}/result"
+		request = urllib.request.Request(url, headers = {'X-SFDC-Session': session['accessToken']})
+		try:
+			with urllib.request.urlopen(request) as response:
+				return response.read().decode('utf8')
+		except urllib.error.HTTPError as httpError:
+			if attempt == 2 or not isExpiredSessionError(httpError):
+				raise
+			print(f'The {orgAlias} session has expired. Looking it up again...')
+			orgSessions.pop(orgAlias, None)
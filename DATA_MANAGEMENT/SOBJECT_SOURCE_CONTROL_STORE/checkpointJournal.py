@@ -0,0 +1,123 @@
+# MIT License
+# Copyright (c) 2023 Andrew Hovey
+# Full License Text: https://ahovey.com/MITLicense.html
+# The above abbreviated copyright notice shall be included in all copies or substantial portions of the Software.
+# -----------------------------------------------------
+
+# https://github.com/ahoveynow/SalesforceUtilities/blob/main/DATA_MANAGEMENT/SOBJECT_SOURCE_CONTROL_STORE
+
+# Checkpoint journals record which steps of a long pull or upsert run have finished, so a run that died halfway
+# (eg. a network blip, an expired session or a CI timeout) can continue where it stopped with --resume.
+#  - One journal per run: {checkpointDirectory}/{runName}.jsonl
+#  - The first line holds a fingerprint of the run's inputs. A journal with a different fingerprint is discarded,
+#    since its finished steps were built from other records or params.
+#  - Every other line is one finished step, eg. {"step": ["upsert", "mySampleOrg", "Some_Object_1__c", 0], "details": {...}}
+#  - Steps are appended (and flushed to disk) as soon as they finish, so a killed run only loses the step in progress
+# A run that completes deletes its journal.
+
+import os
+import json
+import util
+import hashlib
+import threading
+
+
+def getJournalPath(checkpointDirectory, runName):
+	return f'{checkpointDirectory}/{util.keyToFileName(runName)}.jsonl'
+
+
+def getFingerprint(*values):
+	return hashlib.sha1(json.dumps(values, sort_keys = True, separators = (',', ':'), default = str).encode('utf8')).hexdigest()
+
+
+def getFileStats(filePaths):
+	# Files are fingerprinted by modified time and size, so a changed record invalidates the journal without parsing anything
+	fileStats = []
+	for filePath in sorted(filePaths):
+		fileStat = os.stat(filePath)
+		fileStats.append((filePath, fileStat.st_mtime_ns, fileStat.st_size))
+	return fileStats
+
+
+
+###############
+### JOURNAL ###
+
+class CheckpointJournal:
+	# Steps are tuples of strings and numbers, eg. ('convert', 'Some_Object_1__c').
+	# Upsert runs to several orgs finish steps on multiple threads, so appends are locked.
+
+	def __init__(self, journalPath, fingerprint, resume = False):
+		self.journalPath = journalPath
+		self.fingerprint = fingerprint
+		self.detailsByStep = {}
+		self.lock = threading.Lock()
+		self.resumed = resume and self.load()
+		if not self.resumed:
+			self.rewrite()
+
+
+	def load(self):
+		if not os.path.exists(self.journalPath):
+			print(f'No checkpoint journal found at {self.journalPath}. Starting from the beginning.')
+			return False
+
+		with open(self.journalPath, 'r', encoding='utf8') as journalFile:
+			lines = journalFile.read().split('\n')
+		try:
+			header = json.loads(lines[0])
+		except ValueError:
+			header = {}
+		if header.get('fingerprint') != self.fingerprint:
+			print(f'The records or params have changed since {self.journalPath} was written. Starting from the beginning.')
+			return False
+
+		for line in lines[1:]:
+			if not line:
+				continue
+			try:
+				entry = json.loads(line)
+			except ValueError:
+				break # The run was killed while this line was written
+			self.detailsByStep[self.getStepKey(entry['step'])] = entry.get('details')
+
+		self.rewrite() # Drops a partially written last line, so new steps are appended after a complete line
+		print(f'Resuming from {self.journalPath} ({len(self.detailsByStep)} finished step(s)).')
+		return True
+
+
+	def rewrite(self):
+		# Written to a temporary file first, so an interrupted write never leaves a partial journal
+		os.makedirs(os.path.dirname(self.journalPath) or '.', exist_ok=True)
+		temporaryPath = self.journalPath + '.tmp'
+		with open(temporaryPath, 'w', encoding='utf8', newline='\n') as journalFile:
+			journalFile.write(json.dumps({'fingerprint': self.fingerprint}) + '\n')
+			for stepKey, details in self.detailsByStep.items():
+				journalFile.write(json.dumps({'step': json.loads(stepKey), 'details': details}) + '\n')
+		os.replace(temporaryPath, self.journalPath)
+
+
+	def getStepKey(self, step):
+		return json.dumps(list(step))
+
+
+	def isComplete(self, *step):
+		return self.getStepKey(step) in self.detailsByStep
+
+
+	def getDetails(self, *step):
+		return self.detailsByStep.get(self.getStepKey(step))
+
+
+	def markComplete(self, *step, details = None):
+		with self.lock:
+			self.detailsByStep[self.getStepKey(step)] = details
+			with open(self.journalPath, 'a', encoding='utf8', newline='\n') as journalFile:
+				journalFile.write(json.dumps({'step': list(step), 'details': details}) + '\n')
+				journalFile.flush()
+				os.fsync(journalFile.fileno())
+
+
+	def delete(self):
+		if os.path.exists(self.journalPath):
+			os.remove(self.journalPath)
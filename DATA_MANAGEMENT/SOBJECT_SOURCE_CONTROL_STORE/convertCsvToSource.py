@@ -13,12 +13,15 @@
 #   --upsertField Static_ID__c
 #   --objectName Some_Config__c
 #	--jsonFields Some_Json_Field_1__c,Some_Json_Field_2__c
+#	--csvEngine fast	(optional: dict (default), fast or arrow, see csvEngine.py)
 
 
 import util
 import csv
 import os
 import json
+import csvEngine
+import recordTable
 
 # Params
 sourceFile = None
@@ -26,17 +29,25 @@ destinationFolder = None
 upsertField = None
 objectName = None
 jsonFields = None
+csvEngineName = csvEngine.DICT
 
 # Other variables
-csvFileRecords = []
+csvFileRecords = recordTable.RecordTable()
 jsonFieldsArray = []
+writtenFilePaths = []				# json files written by the last conversion (used by pullConfigAndConvertToSource.py for snapshots)
+
+# Key index (built while the csv is read, so collisions are found without re-scanning the destination folder)
+seenKeys = set()					# every upsert key read so far
+firstKeyByFoldedKey = {}			# lowercase key -> first key seen with that lowercase value
+caseCollidingFoldedKeys = set()		# lowercase keys shared by more than one key (eg. "ABC" and "abc")
+duplicateKeys = set()				# keys that appear on more than one row
 
 
 ######################
 ### PROCESS PARAMS ###
 
 def processParams(directParams):
-	global sourceFile, destinationFolder, upsertField, objectName, jsonFields, jsonFieldsArray
+	global sourceFile, destinationFolder, upsertField, objectName, jsonFields, jsonFieldsArray, csvEngineName
 
 	if directParams:
 		params = directParams
@@ -75,6 +86,13 @@ def processParams(directParams):
 			jsonFieldsArray[index] = fileName.strip()
 		print(f'jsonFields: {jsonFields}')
 
+	# csvEngine
+	csvEngineName = ('csvEngine' in params.keys() and params['csvEngine']) or csvEngine.DICT
+	csvEngineError = csvEngine.validateEngine(csvEngineName)
+	if csvEngineError:
+		util.exitWithFailure(csvEngineError)
+	print(f'csvEngine: {csvEngineName}')
+
 
 
 ###########################
@@ -83,37 +101,153 @@ def processParams(directParams):
 def extractCsvRecords():
 	global csvFileRecords
 
-	csvFileContent = open(sourceFile, encoding='utf8')
+	resetKeyIndex()
+	if csvEngine.isPositional(csvEngineName):
+		extractCsvRecordsPositionally()
+		return
+
+	csvFileContent = csvEngine.openCsv(sourceFile)
 	csvReader = csv.DictReader(csvFileContent)
-	csvFileRecords = []
+	if csvReader.fieldnames is not None and upsertField not in csvReader.fieldnames:
+		csvFileContent.close()
+		util.exitWithFailure(f'The upsert field {upsertField} is not a column in {sourceFile}')
+	csvFileRecords = recordTable.RecordTable({'__SObjectType': objectName, '__upsertField': upsertField})
 	for csvRow in csvReader:
-
-		# Revert #N/A to empty string ('') for source management
-		for fieldName, fieldValue in csvRow.items():
-			if fieldValue == '#N/A':
-				csvRow[fieldName] = ''
-
-		csvRow['__SObjectType'] = objectName
-		csvRow['__upsertField'] = upsertField
-
-		# Render JSON Objects on multiple lines
-		for jsonFieldName in jsonFieldsArray:
-			try:
-				jsonFieldValue = csvRow[jsonFieldName]
-				jsonAsObject = json.loads(jsonFieldValue)
-				csvRow[jsonFieldName] = jsonAsObject
-			except:
-				continue
-
-		csvFileRecords.append(csvRow)
+		normalizeCsvRow(csvRow, jsonFieldsArray)
+		indexRecordKey(csvRow[upsertField])
+		csvFileRecords.appendRecord(csvRow) # Stored as a tuple. The row dict is discarded.
 	
 	csvFileContent.close()
+	validateKeyIndex()
+
+
+def extractCsvRecordsPositionally():
+	# Same as extractCsvRecords, without building a dict per row (--csvEngine fast or arrow)
+	global csvFileRecords
+
+	fieldNames, rows = csvEngine.readRows(sourceFile, csvEngineName)
+	if upsertField not in fieldNames:
+		util.exitWithFailure(f'The upsert field {upsertField} is not a column in {sourceFile}')
+	upsertFieldIndex = fieldNames.index(upsertField)
+	jsonFieldIndexes = [fieldNames.index(jsonFieldName) for jsonFieldName in jsonFieldsArray if jsonFieldName in fieldNames]
+
+	csvFileRecords = recordTable.RecordTable({'__SObjectType': objectName, '__upsertField': upsertField})
+	for fieldName in fieldNames:
+		csvFileRecords.getFieldIndex(fieldName)
+	for row in rows:
+		row = normalizeCsvValues(row, jsonFieldIndexes)
+		indexRecordKey(row[upsertFieldIndex])
+		csvFileRecords.appendValues(row)
+
+	validateKeyIndex()
+
+
+def normalizeCsvValues(values, jsonFieldIndexes):
+	# Positional equivalent of normalizeCsvRow, in a single pass for the non-json fields
+	normalizedValues = ['' if value == '#N/A' or value == 'null' else value for value in values]
+	for index in jsonFieldIndexes:
+		value = '' if values[index] == '#N/A' else values[index]
+		if not value:
+			continue # Blank values are never valid json, and raising the parse error is slow
+		try:
+			value = json.loads(value)
+		except:
+			pass
+		normalizedValues[index] = '' if value == 'null' else value
+	return normalizedValues
+
+
+def normalizeCsvRow(csvRow, jsonFieldNames):
+	# Converts a row queried from the org into the values stored in source (also used by planConfigUpsertToOrg.py)
+
+	# Revert #N/A to empty string ('') for source management
+	for fieldName, fieldValue in csvRow.items():
+		if fieldValue == '#N/A':
+			csvRow[fieldName] = ''
+
+	# Render JSON Objects on multiple lines
+	for jsonFieldName in jsonFieldNames:
+		try:
+			jsonFieldValue = csvRow[jsonFieldName]
+			jsonAsObject = json.loads(jsonFieldValue)
+			csvRow[jsonFieldName] = jsonAsObject
+		except:
+			continue
 
 	# TEMPORARY FIX DUE TO CLI BUG: https://github.com/forcedotcom/cli/issues/1447
-	for record in csvFileRecords:
-		for fieldName in record:
-			if record[fieldName] == 'null':
-				record[fieldName] = ''
+	for fieldName, fieldValue in csvRow.items():
+		if fieldValue == 'null':
+			csvRow[fieldName] = ''
+
+	return csvRow
+
+
+
+#################
+### KEY INDEX ###
+
+def resetKeyIndex():
+	global seenKeys, firstKeyByFoldedKey, caseCollidingFoldedKeys, duplicateKeys
+	seenKeys = set()
+	firstKeyByFoldedKey = {}
+	caseCollidingFoldedKeys = set()
+	duplicateKeys = set()
+
+
+def indexRecordKey(key):
+	if key in seenKeys:
+		duplicateKeys.add(key)
+		return
+	seenKeys.add(key)
+
+	foldedKey = key.lower()
+	firstKey = firstKeyByFoldedKey.get(foldedKey)
+	if firstKey is None:
+		firstKeyByFoldedKey[foldedKey] = key
+	else:
+		caseCollidingFoldedKeys.add(foldedKey) # eg. "ABC" and "abc" would overwrite each other on a case-insensitive filesystem
+
+
+def validateKeyIndex():
+	# Two rows with the same key can't both be stored (and would be ambiguous when upserted)
+	if '' in seenKeys:
+		util.exitWithFailure(f'At least one record in {sourceFile} has a blank {upsertField}. Every record needs an upsert key to be stored as source.')
+	if duplicateKeys:
+		duplicateKeysList = sorted(duplicateKeys)
+		util.exitWithFailure(f'{len(duplicateKeysList)} {upsertField} value(s) appear on more than one row in {sourceFile}: {", ".join(duplicateKeysList[:20])}{" ..." if len(duplicateKeysList) > 20 else ""}')
+	for foldedKey in caseCollidingFoldedKeys:
+		print(f'Keys differing only by case found for "{firstKeyByFoldedKey[foldedKey]}". Their file names will have uppercase characters escaped.')
+
+
+def getFileNameForKey(key):
+	return util.keyToFileName(key, escapeUppercase = key.lower() in caseCollidingFoldedKeys)
+
+
+def removeStaleFileNames():
+	# A key's file name changes when a case twin appears or disappears (eg. ABC.json becomes %41%42%43.json once "abc" is pulled too),
+	# and files pulled before names were escaped are named after the raw key (eg. A:B.json is now A%3AB.json).
+	# The record under the key's other names is stale, so it is removed rather than left to be upserted with old values.
+	for row in csvFileRecords:
+		key = csvFileRecords.getValue(row, upsertField)
+		fileName = getFileNameForKey(key)
+		for alternateFileName in util.getAlternateFileNames(key, fileName):
+			alternateFilePath = f'{destinationFolder}/{alternateFileName}.json'
+			if not os.path.isfile(alternateFilePath):
+				continue
+			if getStoredKey(alternateFilePath) == key:
+				print(f'Removing {alternateFilePath} ({key} is now stored as {fileName}.json)')
+				os.remove(alternateFilePath)
+			else:
+				print(f'Warning: {alternateFilePath} holds a record other than "{key}" (eg. one whose key differs only by case). Check whether it is still needed.')
+
+
+def getStoredKey(filePath):
+	try:
+		with open(filePath, 'r', encoding='utf8') as fileToRead:
+			record = json.load(fileToRead)
+		return record.get(record.get('__upsertField'))
+	except (ValueError, AttributeError):
+		return None
 
 
 
@@ -121,14 +255,19 @@ def extractCsvRecords():
 ### WRITE RECORDS TO JSON FILES ###
 
 def writeRecordsToJsonFiles():
+	global writtenFilePaths
 	os.makedirs(destinationFolder, exist_ok=True)
+	writtenFilePaths = []
+	removeStaleFileNames() # Before anything is written, so a new file never lands on a stale one on a case-insensitive filesystem
 
-	for record in csvFileRecords:
-		fileName = f'{destinationFolder}/{record[upsertField]}.json'
+	for row in csvFileRecords:
+		record = csvFileRecords.toDict(row) # Includes __SObjectType and __upsertField
+		fileName = f'{destinationFolder}/{getFileNameForKey(record[upsertField])}.json'
 		print(f'Writing to {fileName}')
 		fileToWrite = open(fileName, 'w')
 		json.dump(record, fileToWrite, indent = '\t', sort_keys = True)
 		fileToWrite.close()
+		writtenFilePaths.append(fileName)
 
 
 
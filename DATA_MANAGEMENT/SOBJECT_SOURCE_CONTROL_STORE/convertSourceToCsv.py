@@ -11,12 +11,18 @@
 #	--sourceFolder dataConfig/Some_Config__c
 #	--destinationFile Some_Config__c_to_upsert.csv
 #	--fileNames "EXT-123,a8eJs77a,Some Config Upsert Value"
+#	--keyPattern "EXT-*"	(optional: only records whose key matches the pattern)
+#	--fields "Some_Field_A__c,Related_Record__r.Name"	(optional: only these columns, plus the upsert field)
+#	--csvEngine fast	(optional: dict (default), fast or arrow, see csvEngine.py)
 
 
 import util
 import csv
 import os
 import json
+import fnmatch
+import csvEngine
+import recordTable
 
 # Params
 sourceFolder = None
@@ -25,18 +31,31 @@ fileNames = None 	# eg: "Record key 73,EXT-123,a8eJs77a,Some Config Upsert"
 					# To include all records (default), don't use this param
 					# spaces around values will be trimmed, eg. "  Some Val  ,  Value2 " resolves to "Some Val,Value2"
 					# Don't include the .json file extension
+					# Escaped file names (eg. "A%2FB" for the key "A/B") are decoded back to their keys
+keyPattern = None	# eg: "EXT-*" (fnmatch syntax, case-sensitive). Only records whose key matches are included.
+fields = None		# eg: "Some_Field_A__c,Related_Record__r.Name"
+					# To include every field (default), don't use this param
+					# The upsert field is always included. A relationship field (Related_Record__r.Name) can also be selected by its lookup field (Related_Record__c).
+csvEngineName = csvEngine.DICT
 
 # Other variables
-records = []
+records = recordTable.RecordTable()
 fileNamesArray = None
+fieldsLowerSet = None
 
 
 ######################
 ### PROCESS PARAMS ###
 
-def processParams():
-	global sourceFolder, destinationFile, fileNames, fileNamesArray
-	params = util.getArgParams()
+def processParams(directParams):
+	global sourceFolder, destinationFile, fileNames, fileNamesArray, keyPattern, fields, fieldsLowerSet, csvEngineName
+
+	if directParams:
+		params = directParams
+	else:
+		params = util.getArgParams()
+	fileNamesArray = None
+	fieldsLowerSet = None
 
 	# sourceFolder
 	sourceFolder = ('sourceFolder' in params.keys() and params['sourceFolder'])
@@ -53,21 +72,80 @@ def processParams():
 	# fileNames
 	fileNames = ('fileNames' in params.keys() and params['fileNames'])
 	if fileNames:
-		fileNamesArray = fileNames.split(',')
-		for index, fileName in enumerate(fileNamesArray):
-			fileNamesArray[index] = fileName.strip()
+		fileNamesArray = set()
+		for fileName in fileNames.split(','):
+			fileNamesArray.add(util.fileNameToKey(fileName.strip()))
 		print(f'fileNames: {fileNames}')
 
+	# keyPattern
+	keyPattern = ('keyPattern' in params.keys() and params['keyPattern']) or None
+	if keyPattern:
+		print(f'keyPattern: {keyPattern}')
+
+	# fields
+	fields = ('fields' in params.keys() and params['fields'])
+	if fields:
+		fieldsLowerSet = set()
+		for fieldName in fields.split(','):
+			fieldsLowerSet.add(fieldName.strip().lower())
+		print(f'fields: {fields}')
+
+	# csvEngine
+	csvEngineName = ('csvEngine' in params.keys() and params['csvEngine']) or csvEngine.DICT
+	csvEngineError = csvEngine.validateEngine(csvEngineName)
+	if csvEngineError:
+		util.exitWithFailure(csvEngineError)
+	print(f'csvEngine: {csvEngineName}')
+
 
 
 ######################################
 ### COMPILE DICTIONARY FROM SOURCE ###
 
+def findSourceFileNames():
+	# Record files are named after their keys (see util.keyToFileName), so the folder is indexed by key
+	# from the file names alone, and only the selected records are parsed.
+	selectedFileNames = []
+	foundKeys = set()
+	for fileName in os.listdir(sourceFolder):
+		if not fileName.lower().endswith('.json'):
+			continue
+		key = util.fileNameToKey(fileName[:-5]) # remove ".json" (5 characters)
+		if fileNamesArray and key not in fileNamesArray:
+			continue
+		if keyPattern and not fnmatch.fnmatchcase(key, keyPattern):
+			continue
+		selectedFileNames.append(fileName)
+		foundKeys.add(key)
+
+	# Files that were renamed by hand don't match their key, so any keys not found by name are looked up by content
+	if fileNamesArray and len(foundKeys) < len(fileNamesArray):
+		print(f'{len(fileNamesArray) - len(foundKeys)} record(s) not found by file name. Checking the content of the other files...')
+		selectedFileNamesSet = set(selectedFileNames)
+		for fileName in os.listdir(sourceFolder):
+			if fileName.lower().endswith('.json') and fileName not in selectedFileNamesSet:
+				selectedFileNames.append(fileName) # The key is checked once the file is parsed
+
+	return selectedFileNames
+
+
+def isSelectedField(fieldName, upsertFieldName):
+	if fieldsLowerSet is None:
+		return True
+	fieldNameLower = fieldName.lower()
+	if fieldNameLower == upsertFieldName.lower() or fieldNameLower in fieldsLowerSet:
+		return True
+	if '.' in fieldName: # A relationship field can be selected by its lookup field
+		return util.getLookupFieldName(fieldName.split('.')[0]).lower() in fieldsLowerSet
+	return False
+
+
 def compileDictFromSource():
 	global records
-	records = []
+	records = recordTable.RecordTable()
+	filePathsByKey = {}
 	
-	for fileName in os.listdir(sourceFolder):
+	for fileName in findSourceFileNames():
 		fileName = os.path.join(sourceFolder, fileName)
 		file = open(fileName, 'r')
 		record = json.load(file)
@@ -75,6 +153,13 @@ def compileDictFromSource():
 		
 		if fileNamesArray and record[record['__upsertField']] not in fileNamesArray:
 			continue # If only including a subset, and this file is not part of that subset, skip it.
+		if keyPattern and not fnmatch.fnmatchcase(record[record['__upsertField']], keyPattern):
+			continue
+		key = record[record['__upsertField']]
+		if key in filePathsByKey:
+			# eg. a stale copy of a record left under another name. Upserting both would send conflicting values for the same key.
+			util.exitWithFailure(f'{filePathsByKey[key]} and {fileName} both hold the record for {key}. Remove the one that is out of date.')
+		filePathsByKey[key] = fileName
 
 		# There are some nuances to setting blank values
 		# For non-lookup fields, a blank value must be set as "#N/A"
@@ -83,15 +168,13 @@ def compileDictFromSource():
 		#  - When the value is blank for lookup field, Related_Object__r.External_ID__c should be an empty string (""), and Related_Object__c should be "#N/A"
 		processedRecord = {}
 		for field_name, field_value in record.items():
-			if '.' in field_name:
+			if field_name == '__SObjectType' or field_name == '__upsertField':
+				continue # Not written to the csv
+			elif not isSelectedField(field_name, record['__upsertField']):
+				continue # Not one of the --fields
+			elif '.' in field_name:
 				externalIdField = field_name
-				directLookup = None # The lookup field someone would query to get the ID of the related record.
-
-				lookupField = field_name.split('.')[0]
-				if (lookupField[-1] == 'r'): # Custom field
-					directLookup = lookupField.rstrip('r') + 'c' # Object__r.Name becomes Object__c
-				else: # Standard field
-					directLookup = lookupField + 'Id' # Account.Name becomes AccountId
+				directLookup = util.getLookupFieldName(field_name.split('.')[0]) # Object__r.Name becomes Object__c, Account.Name becomes AccountId
 
 				if field_value == "":
 					processedRecord[externalIdField] = ""
@@ -105,7 +188,7 @@ def compileDictFromSource():
 			else:
 				processedRecord[field_name] = field_value if field_value != "" else "#N/A"
 
-		records.append(processedRecord)
+		records.appendRecord(processedRecord) # Stored as a tuple. The processed dict is discarded.
 
 	print(f'Records: {len(records)}')
 
@@ -115,26 +198,36 @@ def compileDictFromSource():
 ### WRITE RECORDS TO CSV ###
 
 def writeRecordsToCsv():
-	fields = set(())
-	for record in records:
-		for fieldName in record.keys():
-			if fieldName == '__SObjectType' or fieldName == '__upsertField':
-				continue
-			fields.add(fieldName)
+	fields = records.fieldNames
 
 	os.makedirs(os.path.dirname(destinationFile), exist_ok=True)
+	if csvEngine.isPositional(csvEngineName):
+		# Values are written straight from the record tuples (--csvEngine fast or arrow)
+		sortedFields = sorted(fields)
+		fieldIndexes = [records.fieldIndexes[fieldName] for fieldName in sortedFields]
+		rows = ([getCsvValue(row, index) for index in fieldIndexes] for row in records)
+		csvEngine.writeRows(destinationFile, sortedFields, rows)
+		return
+
 	with open(destinationFile, 'w', newline='', encoding='utf8') as csvfile:
 		writer = csv.DictWriter(csvfile, fieldnames = sorted(fields), extrasaction = 'ignore')
 		writer.writeheader()
-		writer.writerows(records)
+		writer.writerows(records.iterDicts())
+
+
+
+def getCsvValue(row, index):
+	if index >= len(row) or row[index] is recordTable.MISSING:
+		return '' # Missing fields are written as empty values, as csv.DictWriter does
+	return row[index]
 
 
 
 ###############
 ### EXECUTE ###
 
-def execute():
-	processParams()
+def execute(directParams = None):
+	processParams(directParams)
 	compileDictFromSource()
 	writeRecordsToCsv()
 
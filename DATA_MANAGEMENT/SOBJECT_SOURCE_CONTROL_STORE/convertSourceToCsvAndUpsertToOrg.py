@@ -10,18 +10,37 @@ import json
 import shutil
 import subprocess
 import csv
+import time
+import upsertOrder
+import bulkUpsert
+import deployManifest
+import csvEngine
+import fnmatch
+import convertSourceToCsv
+import concurrent.futures
+import checkpointJournal
 
 from objectConfig import OBJECT_CONFIG
 
-validObjects = OBJECT_CONFIG # Object Config defines which objects are accepted and the order in which they are upserted.
+validObjects = OBJECT_CONFIG # Object Config defines which objects are accepted. Upsert order is determined by lookups (see upsertOrder.py), with ties kept in OBJECT_CONFIG order.
 
 SMALL_SPACER = '==============='
 allFilePaths = set()
 objectRecords = {}
 csvsByObject = {}
+upsertSteps = []	# (objectName, csv file path) in the order they will be upserted. Objects that look themselves up have two steps.
+sourceFilePathsByObject = {}	# objectName -> {upsert key: source json file path}. Used to report failed rows against their source files.
+recordHashes = {}				# source json file path -> record hash. Computed once per run and shared by every org's deploy manifest.
+journal = None					# checkpointJournal.CheckpointJournal of the current run. Records the finished steps so a failed run can be resumed.
+
+# Caches (kept warm between runs by watchConfigAndUpsertToOrg.py)
+recordCache = {}				# json file path -> (modified time, size, record)
+recordTypeIdsByOrg = {}			# orgAlias -> {'sobjecttype.developername': RecordTypeId}
 
 # Params
 orgAlias = 'mySampleOrg'					# the sfdx org alias
+orgAliases = None							# Optional comma-separated list of org aliases. The csvs are built once and upserted to every org (see --maxParallelOrgs). This becomes an array when params are processed.
+maxParallelOrgs = 4							# Number of orgs upserted at the same time when --orgAliases is used
 csvDirectory = 'dataConfig/__csv'			# directory where the intermediate csv files will be stored
 pythonCommand = 'python' 					# some installations use python3 rather than python
 sfdxCommand = 'sfdx'						# some installations use a different reference to sfdx
@@ -29,12 +48,23 @@ pythonScriptDir = 'dataConfig/__scripts'	# directory where the scripts are store
 sourceFilePaths = None						# Passed as a comma-separated list of config record file paths (enclose in quotes if spaces are used). This becomes an array when params are processed.
 sourceFolderPaths = None					# Passed as a comma-separated list of folder paths (enclose in quotes if spaces are used). All deeply-nested config records in this folder will be processed. This becomes an array when params are procesed.
 doUpsert = True								# True if csvs should be upserted (default). False if process should stop after generating csv files.
+maxRetries = 3								# Number of times rows that failed with a transient error (eg. UNABLE_TO_LOCK_ROW) are re-upserted. Other failures are reported right away.
+retryDelaySeconds = 5						# Delay before the first retry. The delay doubles on each subsequent retry.
+reportFile = None							# Path of the json upsert report. Defaults to {csvDirectory}/upsertReport.json
+csvEngineName = csvEngine.DICT				# dict (default), fast or arrow. See csvEngine.py
+fields = None								# Optional comma-separated list of fields to upsert (eg. for a hotfix). The upsert field is always included. Passed to convertSourceToCsv.py.
+keyPattern = None							# Optional pattern (fnmatch syntax, eg. "EXT-*"). Only records whose key matches are upserted.
+manifestDirectory = 'dataConfig/__manifests'	# directory where the hashes of the last deployed records are stored per org (used by planConfigUpsertToOrg.py)
+resume = False								# True to continue a failed run from its checkpoint journal, skipping the steps that finished (see checkpointJournal.py)
+checkpointDirectory = 'dataConfig/__checkpoints'	# directory where the checkpoint journals of runs are stored
+shardSize = None							# Optional number of rows per bulk upsert job. Each shard is checkpointed on its own, so a resumed run only upserts the shards that didn't finish.
+convertInProcess = False					# True to convert csvs in this process instead of running convertSourceToCsv.py (used by watch mode to avoid interpreter startup)
 
 ######################
 ### PROCESS PARAMS ###
 
 def processParams():
-	global orgAlias, csvDirectory, sourceFilePaths, sourceFolderPaths, pythonCommand, sfdxCommand, pythonScriptDir, doUpsert
+	global orgAlias, orgAliases, maxParallelOrgs, csvDirectory, sourceFilePaths, sourceFolderPaths, pythonCommand, sfdxCommand, pythonScriptDir, doUpsert, maxRetries, retryDelaySeconds, reportFile, manifestDirectory, csvEngineName, fields, keyPattern, resume, checkpointDirectory, shardSize
 	params = util.getArgParams()
 	print('======= PARAMS =======\nThese can be set with full text flag, eg. --orgAlias mySampleOrg\n')
 
@@ -44,6 +74,25 @@ def processParams():
 		orgAlias = orgAliasParam
 	print(f'orgAlias: {orgAlias}')
 
+	# orgAliases
+	orgAliasesParam = ('orgAliases' in params.keys() and params['orgAliases'])
+	if orgAliasesParam and isinstance(orgAliasesParam, str):
+		orgAliases = []
+		for alias in orgAliasesParam.split(','):
+			if alias.strip() and alias.strip() not in orgAliases:
+				orgAliases.append(alias.strip())
+		if not orgAliases:
+			util.exitWithFailure('Expected a comma-separated list of org aliases as value for --orgAliases param.')
+	print(f'orgAliases: {", ".join(orgAliases) if orgAliases else "None"}')
+
+	# maxParallelOrgs
+	maxParallelOrgsParam = ('maxParallelOrgs' in params.keys() and params['maxParallelOrgs'])
+	if maxParallelOrgsParam:
+		if not str(maxParallelOrgsParam).isdigit() or int(maxParallelOrgsParam) < 1:
+			util.exitWithFailure('Expected a whole number greater than 0 as value for --maxParallelOrgs param.')
+		maxParallelOrgs = int(maxParallelOrgsParam)
+	print(f'maxParallelOrgs: {maxParallelOrgs}')
+
 	# doUpsert
 	doUpsertParam = ('doUpsert' in params.keys() and params['doUpsert'])
 	if doUpsertParam and doUpsertParam.lower() == 'false':
@@ -78,6 +127,74 @@ def processParams():
 		pythonScriptDir = pythonScriptDirParam
 	print(f'pythonScriptDir: {pythonScriptDir}')
 
+	# maxRetries
+	maxRetriesParam = ('maxRetries' in params.keys() and params['maxRetries'])
+	if maxRetriesParam:
+		if not str(maxRetriesParam).isdigit():
+			util.exitWithFailure('Expected a whole number as value for --maxRetries param.')
+		maxRetries = int(maxRetriesParam)
+	print(f'maxRetries: {maxRetries}')
+
+	# retryDelaySeconds
+	retryDelaySecondsParam = ('retryDelaySeconds' in params.keys() and params['retryDelaySeconds'])
+	if retryDelaySecondsParam:
+		if not str(retryDelaySecondsParam).isdigit():
+			util.exitWithFailure('Expected a whole number as value for --retryDelaySeconds param.')
+		retryDelaySeconds = int(retryDelaySecondsParam)
+	print(f'retryDelaySeconds: {retryDelaySeconds}')
+
+	# reportFile
+	reportFileParam = ('reportFile' in params.keys() and params['reportFile'])
+	reportFile = reportFileParam if reportFileParam else f'{csvDirectory}/upsertReport.json'
+	print(f'reportFile: {reportFile}')
+
+	# csvEngine
+	csvEngineParam = ('csvEngine' in params.keys() and params['csvEngine'])
+	if csvEngineParam:
+		csvEngineName = csvEngineParam
+	csvEngineError = csvEngine.validateEngine(csvEngineName)
+	if csvEngineError:
+		util.exitWithFailure(csvEngineError)
+	print(f'csvEngine: {csvEngineName}')
+
+	# fields
+	fieldsParam = ('fields' in params.keys() and params['fields'])
+	if fieldsParam:
+		fields = ','.join(fieldName.strip() for fieldName in fieldsParam.split(','))
+	print(f'fields: {fields or "All"}')
+
+	# keyPattern
+	keyPatternParam = ('keyPattern' in params.keys() and params['keyPattern'])
+	if keyPatternParam:
+		keyPattern = keyPatternParam
+	print(f'keyPattern: {keyPattern or "None"}')
+
+	# manifestDirectory
+	manifestDirectoryParam = ('manifestDirectory' in params.keys() and params['manifestDirectory'])
+	if manifestDirectoryParam:
+		manifestDirectory = manifestDirectoryParam
+	print(f'manifestDirectory: {manifestDirectory}')
+
+	# resume
+	resumeParam = ('resume' in params.keys() and params['resume'])
+	if resumeParam is True or (resumeParam and resumeParam.lower() == 'true'):
+		resume = True
+	print(f'resume: {resume}')
+
+	# checkpointDirectory
+	checkpointDirectoryParam = ('checkpointDirectory' in params.keys() and params['checkpointDirectory'])
+	if checkpointDirectoryParam:
+		checkpointDirectory = checkpointDirectoryParam
+	print(f'checkpointDirectory: {checkpointDirectory}')
+
+	# shardSize
+	shardSizeParam = ('shardSize' in params.keys() and params['shardSize'])
+	if shardSizeParam:
+		if not str(shardSizeParam).isdigit() or int(shardSizeParam) < 1:
+			util.exitWithFailure('Expected a whole number greater than 0 as value for --shardSize param.')
+		shardSize = int(shardSizeParam)
+	print(f'shardSize: {shardSize or "None"}')
+
 	# sourceFilePaths
 	sourceFilePathsParam = ('sourceFilePaths' in params.keys() and params['sourceFilePaths'])
 	print(f'\n=== Source File Paths: ')
@@ -111,7 +228,7 @@ def consolidateFilePaths():
 		for filePath in sourceFilePaths:
 			if os.path.isabs(filePath):
 				filePath = os.path.relpath(filePath, '.')
-			if filePath.lower().endswith('.json'):
+			if isSelectedFilePath(filePath):
 				allFilePaths.add(filePath)
 
 	# Recursively traverse folder paths and add applicable json files
@@ -123,14 +240,45 @@ def consolidateFilePaths():
 			absolutePath = os.getcwd() + '/' + folderPath
 
 		for subdir, dirs, files in os.walk(absolutePath):
+			dirs[:] = [dirName for dirName in dirs if not dirName.startswith('__')] # eg. __csv (reports), __checkpoints, __temp
 			for filePath in files:
-				if filePath.lower().endswith('.json'):
+				if isSelectedFilePath(filePath):
 					filePath = subdir + '/' + filePath
 					if os.path.isabs(filePath):
 						filePath = os.path.relpath(filePath, '.')
 					allFilePaths.add(filePath)
 
 
+def isSelectedFilePath(filePath):
+	# Records are selected by --keyPattern from their file names, without parsing them
+	if not filePath.lower().endswith('.json'):
+		return False
+	return not keyPattern or fnmatch.fnmatchcase(util.fileNameToKey(os.path.basename(filePath)[:-5]), keyPattern)
+
+
+def resetRunState():
+	global allFilePaths, objectRecords, csvsByObject, upsertSteps, sourceFilePathsByObject, recordHashes
+	allFilePaths = set()
+	objectRecords = {}
+	csvsByObject = {}
+	upsertSteps = []
+	sourceFilePathsByObject = {}
+	recordHashes = {}
+
+
+def loadRecord(fileName):
+	# Records are only parsed again when their file has changed
+	fileStat = os.stat(fileName)
+	cachedRecord = recordCache.get(fileName)
+	if cachedRecord and cachedRecord[0] == fileStat.st_mtime_ns and cachedRecord[1] == fileStat.st_size:
+		return cachedRecord[2]
+	file = open(fileName, 'r', encoding='utf8')
+	record = json.load(file)
+	file.close()
+	recordCache[fileName] = (fileStat.st_mtime_ns, fileStat.st_size, record)
+	return record
+
+
 def deleteTempFolder():
 	if os.path.exists('__temp') and os.path.isdir('__temp'):
 		shutil.rmtree('__temp')
@@ -138,25 +286,28 @@ def deleteTempFolder():
 
 def prepForConversion():
 	global objectRecords
-	deleteTempFolder()
+	if not journal.resumed:
+		deleteTempFolder() # A resumed run keeps __temp, and only copies the records of objects that weren't converted yet
 	os.makedirs('__temp', exist_ok=True)
 	acceptableObjectsLower = {}
 	for objectName in validObjects.keys():
 		acceptableObjectsLower[objectName.lower()] = objectName
 	
 	for fileName in allFilePaths:
-		file = open(fileName, 'r', encoding='utf8')
-		record = json.load(file)
-		file.close()
-		lowercaseObjectName = (record['__SObjectType'] or '').lower()
+		record = loadRecord(fileName)
+		if not isinstance(record, dict):
+			continue # Not a config record
+		lowercaseObjectName = (record.get('__SObjectType') or '').lower() # Other json files (eg. the upsert report) have no __SObjectType
 		if lowercaseObjectName in acceptableObjectsLower.keys():
 			correctCaseObjectName = acceptableObjectsLower[lowercaseObjectName]
-			os.makedirs('__temp/' + correctCaseObjectName, exist_ok=True)
 			if correctCaseObjectName not in objectRecords.keys():
 				objectRecords[correctCaseObjectName] = []
 			fileNameOnly = os.path.basename(fileName)
 			objectRecords[correctCaseObjectName].append(fileNameOnly[:-5]) # remove ".json" (5 characters)
-			shutil.copy(fileName, f'__temp/{correctCaseObjectName}/{fileNameOnly}')
+			sourceFilePathsByObject.setdefault(correctCaseObjectName, {})[record.get(record.get('__upsertField'), '')] = fileName
+			if not journal.isComplete('convert', correctCaseObjectName):
+				os.makedirs('__temp/' + correctCaseObjectName, exist_ok=True)
+				shutil.copy(fileName, f'__temp/{correctCaseObjectName}/{fileNameOnly}')
 
 
 def convertToCsvs():
@@ -165,19 +316,34 @@ def convertToCsvs():
 	for objectName in validObjects.keys():
 		if objectName not in objectRecords.keys():
 			continue # Skip. We are iterating on validObjects to ensure correct order based on objectConfig.py
+		destinationFile = f"{csvDirectory}/{objectName}.csv"
+		if journal.isComplete('convert', objectName):
+			if not os.path.exists(destinationFile):
+				util.exitWithFailure(f'{destinationFile} was removed after it was checkpointed. Run again without --resume.')
+			print(f'===== Convert source ({objectName}): already converted (resumed)')
+			csvsByObject[objectName] = destinationFile
+			continue
 		command = [pythonCommand, f"{pythonScriptDir}/convertSourceToCsv.py"]
 		command.extend(['--sourceFolder', f"__temp/{objectName}"])
-		destinationFile = f"{csvDirectory}/{objectName}.csv"
 		command.extend(['--destinationFile', destinationFile])
 		recordNames = ','.join(objectRecords[objectName])
 		command.extend(['--fileNames', recordNames])
+		command.extend(['--csvEngine', csvEngineName])
+		if fields:
+			command.extend(['--fields', fields])
 		print(f'===== Convert source ({objectName})')
 		print(command)
-		subprocess.check_call(command) # Fails process if there was a failure
+		if convertInProcess:
+			convertSourceToCsv.execute({'sourceFolder': f"__temp/{objectName}", 'destinationFile': destinationFile, 'fileNames': recordNames, 'csvEngine': csvEngineName, 'fields': fields})
+		else:
+			subprocess.check_call(command) # Fails process if there was a failure
 		csvsByObject[objectName] = destinationFile
+		journal.markComplete('convert', objectName)
 
 
-def addRecordTypeIds():
+def addRecordTypeIds(targetOrgAlias, targetCsvDirectory):
+	# Record Type ids differ between orgs, so each org resolves them on its own copy of the csvs
+	recordTypeMap = recordTypeIdsByOrg.setdefault(targetOrgAlias, {})
 	recordTypeDeveloperNameSet = set()
 	recordsByObject = dict()
 	developerNameColumnNamesByObject = dict()
@@ -188,95 +354,461 @@ def addRecordTypeIds():
 		if objectName not in objectRecords.keys():
 			continue # Skip. We are iterating on validObjects to ensure correct order based on objectConfig.py
 		
-		csvFilePath = f"{csvDirectory}/{objectName}.csv"
-		csvFileContent = open(csvFilePath, encoding='utf8')
-		csvReader = csv.DictReader(csvFileContent)
+		csvFilePath = f"{targetCsvDirectory}/{objectName}.csv"
+		if csvEngine.isPositional(csvEngineName):
+			fieldNames, csvRows = csvEngine.readRows(csvFilePath, csvEngineName)
+		else:
+			csvFileContent = csvEngine.openCsv(csvFilePath)
+			csvReader = csv.DictReader(csvFileContent)
+			fieldNames = csvReader.fieldnames
+			csvRows = csvReader
 		
 		# Determine if RecordType.DeveloperName is one of the columns
 		developerNameColumnName = None
 		recordTypeDeveloperNameColumnFound = False
-		fieldNamesByObject[objectName] = csvReader.fieldnames
-		for columnName in csvReader.fieldnames:
+		fieldNamesByObject[objectName] = fieldNames
+		for columnIndex, columnName in enumerate(fieldNames):
 			if columnName.lower() == 'recordtype.developername':
-				developerNameColumnName = columnName
+				# Rows are lists for positional csv engines, so the column is referenced by index
+				developerNameColumnName = columnIndex if csvEngine.isPositional(csvEngineName) else columnName
 				developerNameColumnNamesByObject[objectName] = developerNameColumnName
 				recordTypeDeveloperNameColumnFound = True
 				break
 		if not recordTypeDeveloperNameColumnFound:
+			if not csvEngine.isPositional(csvEngineName):
+				csvFileContent.close()
 			continue # skip -- only need to process csvs with RecordType.DeveloperName
 		
 		csvFileRecords = []
-		for csvRow in csvReader:
-			csvFileRecords.append(csvRow)
-			if csvRow[developerNameColumnName]:
+		for csvRow in csvRows:
+			if not csvEngine.isPositional(csvEngineName):
+				csvFileRecords.append(csvRow) # Positional csv engines stream the csv again when the ids are set, rather than holding every row
+			if csvRow[developerNameColumnName] and f'{objectName}.{csvRow[developerNameColumnName]}'.lower() not in recordTypeMap:
 				recordTypeDeveloperNameSet.add(f"'{csvRow[developerNameColumnName]}'")
 		recordsByObject[objectName] = csvFileRecords
-		csvFileContent.close()
+		if not csvEngine.isPositional(csvEngineName):
+			csvFileContent.close()
 	
-	# Query Salesforce for Record Type IDs
-	queryCommand = f'sfdx force:data:soql:query --json --wait 10 -u {orgAlias} --query "SELECT Id, DeveloperName, Name, NamespacePrefix, SobjectType FROM RecordType WHERE DeveloperName IN ({",".join(recordTypeDeveloperNameSet)})"'
-	queryResultString = subprocess.check_output(queryCommand, shell=True)
-	queryResult = json.loads(queryResultString)
-	recordTypeMap = dict()
-	for resultRecord in queryResult['result']['records']:
-		recordTypeMap[f"{resultRecord['SobjectType']}.{resultRecord['DeveloperName']}".lower()] = resultRecord['Id']
+	# Query Salesforce for Record Type IDs (only the ones that haven't been looked up for this org yet)
+	if recordTypeDeveloperNameSet:
+		queryCommand = [sfdxCommand, 'force:data:soql:query', '--wait', '10', '-u', targetOrgAlias]
+		queryCommand.extend(['--query', f'SELECT Id, DeveloperName, Name, NamespacePrefix, SobjectType FROM RecordType WHERE DeveloperName IN ({",".join(sorted(recordTypeDeveloperNameSet))})'])
+		queryResult = util.runJsonCommand(queryCommand)
+		if not queryResult or queryResult.get('status') != 0:
+			util.exitWithFailure(f'Could not query Record Types from org {targetOrgAlias}. Upsert has been cancelled.')
+		for resultRecord in queryResult['result']['records']:
+			recordTypeMap[f"{resultRecord['SobjectType']}.{resultRecord['DeveloperName']}".lower()] = resultRecord['Id']
 
 	# Set RecordTypeId on relevant objects
 	for objectName, records in recordsByObject.items():
+		developerNameColumnName = developerNameColumnNamesByObject[objectName]
+		if csvEngine.isPositional(csvEngineName):
+			setRecordTypeIdsPositionally(f"{targetCsvDirectory}/{objectName}.csv", objectName, developerNameColumnName, recordTypeMap, targetOrgAlias)
+			continue
+
 		for record in records:
-			developerNameColumnName = developerNameColumnNamesByObject[objectName]
-			recordTypeId = recordTypeMap[f'{objectName}.{record[developerNameColumnName]}'.lower()]
+			if not record[developerNameColumnName]:
+				continue # No Record Type to set
+			recordTypeId = recordTypeMap.get(f'{objectName}.{record[developerNameColumnName]}'.lower())
 			if(recordTypeId):
 				record[developerNameColumnName] = ''
 				record['RecordTypeId'] = recordTypeId
 			else:
-				util.exitWithFailure(f'No Record Type {developerNameColumnName} found in org {orgAlias}. Upsert has been cancelled.')
+				util.exitWithFailure(f'No Record Type {record[developerNameColumnName]} found for {objectName} in org {targetOrgAlias}. Upsert has been cancelled.')
 		
-		# Replace csv with updated
-		with open(f"{csvDirectory}/{objectName}.csv", 'w', newline='', encoding='utf8') as csvfile:
+		# Replace csv with updated (through a temporary file, so a killed run never leaves a partial csv)
+		csvFilePath = f"{targetCsvDirectory}/{objectName}.csv"
+		with open(csvFilePath + '.tmp', 'w', newline='', encoding='utf8') as csvfile:
 			writer = csv.DictWriter(csvfile, fieldnames = sorted(fieldNamesByObject[objectName]), extrasaction = 'ignore')
 			writer.writeheader()
 			writer.writerows(records)
+		os.replace(csvFilePath + '.tmp', csvFilePath)
 			
 
-def upsertRecords():
-	print('\n\n===== UPSERT RECORDS =====\n\n')
-	for objectName in csvsByObject.keys():
-		command = [sfdxCommand, 'force:data:bulk:upsert']
-		command.extend(['-u', orgAlias])
-		command.extend(['-i', validObjects[objectName]['upsertField']])
-		command.extend(['-f', csvsByObject[objectName]])
-		command.extend(['-s', objectName])
-		command.extend(['-w', '10'])
-		print(f'===== SFDX Command ({objectName})')
-		print(command)
-		subprocess.check_call(command, shell=True) # Fails process if there was a failure
+def setRecordTypeIdsPositionally(csvFilePath, objectName, developerNameColumnIndex, recordTypeMap, targetOrgAlias):
+	# Streams the csv into a new file with the Record Type ids set (--csvEngine fast or arrow)
+	fieldNames, csvRows = csvEngine.readRows(csvFilePath, csvEngineName)
+	recordTypeIdColumnIndex = fieldNames.index('RecordTypeId') if 'RecordTypeId' in fieldNames else None
+	sortedFieldNames = sorted(fieldNames)
+	columnIndexes = [fieldNames.index(fieldName) for fieldName in sortedFieldNames] if sortedFieldNames != fieldNames else None
+
+	def iterUpdatedRows():
+		for csvRow in csvRows:
+			developerName = csvRow[developerNameColumnIndex]
+			if developerName:
+				recordTypeId = recordTypeMap.get(f'{objectName}.{developerName}'.lower())
+				if not recordTypeId:
+					util.exitWithFailure(f'No Record Type {developerName} found for {objectName} in org {targetOrgAlias}. Upsert has been cancelled.')
+				csvRow[developerNameColumnIndex] = ''
+				if recordTypeIdColumnIndex is not None:
+					csvRow[recordTypeIdColumnIndex] = recordTypeId
+			yield csvRow if columnIndexes is None else [csvRow[index] for index in columnIndexes]
+
+	csvEngine.writeRows(csvFilePath + '.tmp', sortedFieldNames, iterUpdatedRows())
+	os.replace(csvFilePath + '.tmp', csvFilePath)
+
+
+def planUpsertOrder():
+	global upsertSteps
+	print('\n\n===== DETERMINE UPSERT ORDER =====\n\n')
+	fieldNamesByObject = {}
+	for objectName, csvFilePath in csvsByObject.items():
+		with open(csvFilePath, newline='', encoding='utf8') as csvFileContent:
+			fieldNamesByObject[objectName] = next(csv.reader(csvFileContent), [])
+		if journal.isComplete('split', objectName):
+			# Split by the run being resumed, so the self lookups are only in the second pass csv
+			replaceSplitCsvs(objectName)
+			with open(getSelfLookupCsvFilePath(objectName), newline='', encoding='utf8') as csvFileContent:
+				fieldNamesByObject[objectName] += next(csv.reader(csvFileContent), [])
+
+	dependenciesByObject, selfRelationshipsByObject = upsertOrder.buildDependencyGraph(fieldNamesByObject, validObjects)
+	upsertSteps = []
+	for objectName in upsertOrder.computeUpsertOrder(dependenciesByObject, validObjects):
+		dependencies = sorted(dependenciesByObject[objectName])
+		print(f'{objectName}' + (f' (after {", ".join(dependencies)})' if dependencies else ''))
+		if objectName in selfRelationshipsByObject:
+			if not journal.isComplete('split', objectName):
+				splitSelfLookups(objectName, selfRelationshipsByObject[objectName])
+				journal.markComplete('split', objectName)
+				replaceSplitCsvs(objectName)
+			upsertSteps.append((objectName, csvsByObject[objectName]))
+			upsertSteps.append((objectName, getSelfLookupCsvFilePath(objectName)))
+		else:
+			upsertSteps.append((objectName, csvsByObject[objectName]))
+
+
+def getSelfLookupCsvFilePath(objectName):
+	return f"{csvDirectory}/{objectName}__selfLookups.csv"
+
+
+def splitSelfLookups(objectName, selfRelationshipNames):
+	# Records can't reference records of the same object that don't exist yet, so self lookups are set in a second pass:
+	#  - {objectName}.csv keeps every column except the self lookups
+	#  - {objectName}__selfLookups.csv has only the upsert field and the self lookups
+	print(f'  {objectName} looks itself up ({", ".join(selfRelationshipNames)}). Self lookups will be set in a second pass.')
+	csvFilePath = csvsByObject[objectName]
+	selfLookupCsvFilePath = getSelfLookupCsvFilePath(objectName)
+	upsertFieldLower = validObjects[objectName]['upsertField'].lower()
+
+	selfLookupColumnNamesLower = set()
+	for relationshipName in selfRelationshipNames:
+		selfLookupColumnNamesLower.add(util.getLookupFieldName(relationshipName).lower())
+
+	with open(csvFilePath, newline='', encoding='utf8') as csvFileContent:
+		csvReader = csv.reader(csvFileContent)
+		fieldNames = next(csvReader)
+		rows = list(csvReader)
+
+	firstPassIndexes = []
+	secondPassIndexes = []
+	for index, fieldName in enumerate(fieldNames):
+		fieldNameLower = fieldName.lower()
+		isSelfLookup = fieldNameLower in selfLookupColumnNamesLower or ('.' in fieldName and fieldName.split('.')[0] in selfRelationshipNames)
+		if isSelfLookup:
+			secondPassIndexes.append(index)
+		else:
+			firstPassIndexes.append(index)
+		if fieldNameLower == upsertFieldLower:
+			secondPassIndexes.insert(0, index)
+
+	# Both csvs are written to temporary files. They replace the csvs once the split is checkpointed (see replaceSplitCsvs),
+	# so a killed run either still has the unsplit csv, or a checkpoint saying the split happened.
+	with open(selfLookupCsvFilePath + '.tmp', 'w', newline='', encoding='utf8') as csvfile:
+		writer = csv.writer(csvfile)
+		writer.writerow([fieldNames[index] for index in secondPassIndexes])
+		writer.writerows([row[index] for index in secondPassIndexes] for row in rows)
+
+	with open(csvFilePath + '.tmp', 'w', newline='', encoding='utf8') as csvfile:
+		writer = csv.writer(csvfile)
+		writer.writerow([fieldNames[index] for index in firstPassIndexes])
+		writer.writerows([row[index] for index in firstPassIndexes] for row in rows)
+
+
+def replaceSplitCsvs(objectName):
+	# Also run when resuming, in case the run was killed after the split was checkpointed but before both csvs were replaced
+	for csvFilePath in (getSelfLookupCsvFilePath(objectName), csvsByObject[objectName]):
+		if os.path.exists(csvFilePath + '.tmp'):
+			os.replace(csvFilePath + '.tmp', csvFilePath)
+
+
+def upsertRecords(targetOrgAlias, targetUpsertSteps, targetReportFile):
+	print(f'\n\n===== UPSERT RECORDS ({targetOrgAlias}) =====\n\n')
+	report = {'orgAlias': targetOrgAlias, 'steps': []}
+	upsertShards = [] # (objectName, csv file path of the step, shard index, csv file path of the shard)
+	for objectName, csvFilePath in targetUpsertSteps:
+		for shardIndex, shardCsvFilePath in enumerate(splitIntoShards(csvFilePath)):
+			upsertShards.append((objectName, csvFilePath, shardIndex, shardCsvFilePath))
+	try:
+		upsertShardsInOrder(targetOrgAlias, upsertShards, report, targetReportFile)
+	finally:
+		# Shards are split again from the step's csv when resuming, so none are kept once the run stops
+		for objectName, csvFilePath, shardIndex, shardCsvFilePath in upsertShards:
+			removeShard(csvFilePath, shardCsvFilePath)
+	writeReport(report, targetReportFile)
+
+
+def upsertShardsInOrder(targetOrgAlias, upsertShards, report, targetReportFile):
+	for shardPosition, (objectName, csvFilePath, shardIndex, shardCsvFilePath) in enumerate(upsertShards):
+		checkpointStep = ('upsert', targetOrgAlias, os.path.basename(csvFilePath), shardIndex)
+		if journal.isComplete(*checkpointStep):
+			print(f'===== Upsert ({objectName} to {targetOrgAlias}): {shardCsvFilePath} already upserted (resumed)')
+			stepReport = journal.getDetails(*checkpointStep)
+		else:
+			print(f'===== Upsert ({objectName} to {targetOrgAlias}): {shardCsvFilePath}')
+			stepReport = upsertWithRetries(targetOrgAlias, objectName, shardCsvFilePath)
+			print(f"{targetOrgAlias} {objectName}: {stepReport['recordsSucceeded']} succeeded, {stepReport['recordsFailed']} failed, {stepReport.get('recordsUnconfirmed', 0)} unconfirmed ({stepReport['attempts']} attempt(s))\n")
+		report['steps'].append(stepReport)
+
+		if stepReport['recordsFailed'] or stepReport.get('recordsUnconfirmed'):
+			# Later steps may look up the records that failed, so stop here (as a failed bulk job always has)
+			for skippedObjectName, skippedCsvFilePath, skippedShardIndex, skippedShardCsvFilePath in upsertShards[shardPosition + 1:]:
+				report['steps'].append({'objectName': skippedObjectName, 'csvFile': skippedShardCsvFilePath, 'skipped': True})
+			writeReport(report, targetReportFile)
+			for failure in (stepReport['failures'] + stepReport.get('unconfirmed', []))[:20]:
+				print(f"{failure['key']} ({failure['sourceFile']}): {failure['error']}")
+			if stepReport.get('recordsUnconfirmed'):
+				util.exitWithFailure(f"{stepReport['recordsUnconfirmed']} {objectName} record(s) upserted to {targetOrgAlias} could not be confirmed (their batch was still running, or its results could not be matched) and {stepReport['recordsFailed']} failed. Check the bulk job in the org before running again. See {targetReportFile} for details.")
+			util.exitWithFailure(f"{stepReport['recordsFailed']} {objectName} record(s) failed to upsert to {targetOrgAlias} after {stepReport['attempts']} attempt(s). See {targetReportFile} for details. Run again with --resume to continue from this step.")
+		journal.markComplete(*checkpointStep, details = stepReport)
+		removeShard(csvFilePath, shardCsvFilePath)
+
+		isLastStepForObject = objectName not in [laterShard[0] for laterShard in upsertShards[shardPosition + 1:]]
+		if isLastStepForObject and not fields:
+			updateDeployManifest(targetOrgAlias, objectName) # Skipped when only some --fields were upserted, since the org doesn't have the whole record yet
+
+
+def splitIntoShards(csvFilePath):
+	# With --shardSize, large csvs are upserted as several jobs of at most shardSize rows: {csv}__shard{n}.csv
+	if not shardSize:
+		return [csvFilePath]
+
+	shardCsvFilePaths = []
+	with open(csvFilePath, newline='', encoding='utf8') as csvFileContent:
+		csvReader = csv.reader(csvFileContent)
+		fieldNames = next(csvReader, [])
+		shardRows = []
+		for row in csvReader:
+			shardRows.append(row)
+			if len(shardRows) == shardSize:
+				shardCsvFilePaths.append(writeShard(csvFilePath, len(shardCsvFilePaths), fieldNames, shardRows))
+				shardRows = []
+		if shardRows or not shardCsvFilePaths:
+			shardCsvFilePaths.append(writeShard(csvFilePath, len(shardCsvFilePaths), fieldNames, shardRows))
+
+	if len(shardCsvFilePaths) == 1:
+		os.remove(shardCsvFilePaths[0])
+		return [csvFilePath] # Small enough to upsert as is
+	return shardCsvFilePaths
+
+
+def removeShard(csvFilePath, shardCsvFilePath):
+	if shardCsvFilePath != csvFilePath and os.path.exists(shardCsvFilePath):
+		os.remove(shardCsvFilePath)
+
+
+def writeShard(csvFilePath, shardIndex, fieldNames, rows):
+	shardCsvFilePath = f'{csvFilePath[:-4]}__shard{shardIndex}.csv'
+	with open(shardCsvFilePath, 'w', newline='', encoding='utf8') as csvfile:
+		writer = csv.writer(csvfile)
+		writer.writerow(fieldNames)
+		writer.writerows(rows)
+	return shardCsvFilePath
+
+
+def updateDeployManifest(targetOrgAlias, objectName):
+	# Every record of the object was upserted, so its hash becomes the last deployed hash for this org
+	updatedEntries = {}
+	for key, sourceFilePath in sourceFilePathsByObject.get(objectName, {}).items():
+		if sourceFilePath not in recordHashes:
+			recordHashes[sourceFilePath] = deployManifest.hashRecord(loadRecord(sourceFilePath))
+		updatedEntries[deployManifest.getManifestKey(key)] = recordHashes[sourceFilePath]
+	deployManifest.mergeManifest(deployManifest.getManifestPath(manifestDirectory, targetOrgAlias, objectName), updatedEntries)
+
+
+def upsertWithRetries(targetOrgAlias, objectName, csvFilePath):
+	upsertField = validObjects[objectName]['upsertField']
+	with open(csvFilePath, newline='', encoding='utf8') as csvFileContent:
+		csvReader = csv.reader(csvFileContent)
+		fieldNames = next(csvReader)
+		pendingRows = list(csvReader)
+	upsertFieldIndex = [fieldName.lower() for fieldName in fieldNames].index(upsertField.lower())
+	rowCount = len(pendingRows)
+
+	attempt = 0
+	attemptCsvFilePath = csvFilePath
+	retryCsvFilePaths = []
+	failedRowErrors = []
+	unconfirmedRowErrors = [] # Rows still pending in the org, or whose result is unknown. They aren't retried, since that could upsert them twice.
+	while True:
+		attempt += 1
+		rowResults = bulkUpsert.upsertCsv(sfdxCommand, targetOrgAlias, objectName, upsertField, attemptCsvFilePath, len(pendingRows))
+		transientRowErrors = []
+		for row, (status, error) in zip(pendingRows, rowResults):
+			if status == bulkUpsert.FAILED:
+				# Errors that would fail the same way again (eg. REQUIRED_FIELD_MISSING) are reported without retrying
+				(transientRowErrors if bulkUpsert.isTransientError(error) else failedRowErrors).append((row, error))
+			elif status in (bulkUpsert.PENDING, bulkUpsert.UNKNOWN):
+				unconfirmedRowErrors.append((row, f'{status}: {error}'))
+		if not transientRowErrors or attempt > maxRetries:
+			failedRowErrors.extend(transientRowErrors)
+			break
+
+		# Retry only the rows that failed with a transient error
+		delaySeconds = retryDelaySeconds * (2 ** (attempt - 1))
+		print(f'{targetOrgAlias} {objectName}: {len(transientRowErrors)} row(s) failed with a transient error. Retrying them in {delaySeconds} second(s)...')
+		time.sleep(delaySeconds)
+		pendingRows = [row for row, error in transientRowErrors]
+		attemptCsvFilePath = f'{csvFilePath[:-4]}__retry{attempt}.csv'
+		retryCsvFilePaths.append(attemptCsvFilePath)
+		with open(attemptCsvFilePath, 'w', newline='', encoding='utf8') as csvfile:
+			writer = csv.writer(csvfile)
+			writer.writerow(fieldNames)
+			writer.writerows(pendingRows)
+
+	for retryCsvFilePath in retryCsvFilePaths: # Only needed while the step runs. A resumed step starts again from its own csv.
+		os.remove(retryCsvFilePath)
+
+	sourceFilePaths = sourceFilePathsByObject.get(objectName, {})
+	failures = []
+	for row, error in failedRowErrors:
+		key = row[upsertFieldIndex]
+		failures.append({'key': key, 'sourceFile': sourceFilePaths.get(key), 'error': error})
+	unconfirmed = []
+	for row, error in unconfirmedRowErrors:
+		key = row[upsertFieldIndex]
+		unconfirmed.append({'key': key, 'sourceFile': sourceFilePaths.get(key), 'error': error})
+
+	return {
+		'objectName': objectName,
+		'csvFile': csvFilePath,
+		'attempts': attempt,
+		'recordsProcessed': rowCount,
+		'recordsSucceeded': rowCount - len(failures) - len(unconfirmed),
+		'recordsFailed': len(failures),
+		'recordsUnconfirmed': len(unconfirmed),
+		'failures': failures,
+		'unconfirmed': unconfirmed,
+	}
+
+
+def writeReport(report, targetReportFile):
+	reportDirectory = os.path.dirname(targetReportFile)
+	if reportDirectory:
+		os.makedirs(reportDirectory, exist_ok=True)
+	with open(targetReportFile, 'w', encoding='utf8') as fileToWrite:
+		json.dump(report, fileToWrite, indent = '\t')
+	print(f'Upsert report: {targetReportFile}')
 
 
 def printPaths():
-	print('=== FILE PATHS:')
-	for objectName in csvsByObject.keys():
-		print(f'{objectName}: {csvsByObject[objectName]}')
+	print('=== FILE PATHS (in upsert order):')
+	for objectName, csvFilePath in upsertSteps:
+		print(f'{objectName}: {csvFilePath}')
+	if orgAliases:
+		print(f'(copied to {csvDirectory}/{{orgAlias}} for each org, where the Record Type ids are set)')
+
+
+
+###########################
+### CROSS-ORG FAN-OUT ###
+
+def getOrgReportFile(targetOrgAlias):
+	# eg. dataConfig/__csv/upsertReport.json -> dataConfig/__csv/upsertReport.mySandbox.json
+	reportFileBase, reportFileExtension = os.path.splitext(reportFile)
+	return f'{reportFileBase}.{targetOrgAlias}{reportFileExtension or ".json"}'
+
+
+def deployToOrg(targetOrgAlias):
+	# With --orgAliases, each org gets its own copy of the csvs, since Record Type ids differ between orgs
+	targetCsvDirectory = f'{csvDirectory}/{targetOrgAlias}'
+	os.makedirs(targetCsvDirectory, exist_ok=True)
+	isPrepared = journal.isComplete('recordTypes', targetOrgAlias) # A resumed run keeps the org's csvs, which already have the Record Type ids
+	targetUpsertSteps = []
+	for objectName, csvFilePath in upsertSteps:
+		targetCsvFilePath = f'{targetCsvDirectory}/{os.path.basename(csvFilePath)}'
+		if not isPrepared:
+			shutil.copy(csvFilePath, targetCsvFilePath)
+		targetUpsertSteps.append((objectName, targetCsvFilePath))
+
+	if not isPrepared:
+		addRecordTypeIds(targetOrgAlias, targetCsvDirectory)
+		journal.markComplete('recordTypes', targetOrgAlias)
+	if doUpsert:
+		upsertRecords(targetOrgAlias, targetUpsertSteps, getOrgReportFile(targetOrgAlias))
+
+
+def deployToOrgs():
+	print(f'\n\n===== DEPLOY TO {len(orgAliases)} ORGS ({maxParallelOrgs} at a time) =====\n\n')
+	orgResults = []
+	with concurrent.futures.ThreadPoolExecutor(max_workers = maxParallelOrgs) as executor:
+		futuresByOrgAlias = {targetOrgAlias: executor.submit(deployToOrg, targetOrgAlias) for targetOrgAlias in orgAliases}
+		for targetOrgAlias, future in futuresByOrgAlias.items():
+			orgResult = {'orgAlias': targetOrgAlias, 'status': 'Succeeded', 'error': None}
+			try:
+				future.result()
+			except SystemExit as exception:
+				# Raised by util.exitWithFailure. Only this org is stopped.
+				orgResult['status'] = 'Failed'
+				orgResult['error'] = str(exception.code)
+			except Exception as exception:
+				orgResult['status'] = 'Failed'
+				orgResult['error'] = str(exception)
+			orgReportFile = getOrgReportFile(targetOrgAlias)
+			orgResult['reportFile'] = orgReportFile if os.path.exists(orgReportFile) else None
+			orgResults.append(orgResult)
+
+	if doUpsert:
+		writeReport({'orgAliases': orgAliases, 'orgs': orgResults}, reportFile)
+	print('\n=== RESULTS BY ORG:')
+	for orgResult in orgResults:
+		print(f"{orgResult['orgAlias']}: {orgResult['status']}" + (f" ({orgResult['error']})" if orgResult['error'] else '') + (f" - {orgResult['reportFile']}" if orgResult['reportFile'] else ''))
+	return [orgResult['orgAlias'] for orgResult in orgResults if orgResult['status'] != 'Succeeded']
 
 
 
 ###############
 ### EXECUTE ###
 
-def execute():
-	print('\n\n================================================\n==========   UPSERT SALESFORCE CONFIG   ==========\n================================================\n')
-	processParams()
+def openJournal():
+	# The journal is only resumed when the same records (unchanged since the failed run) are upserted with the same params
+	global journal
+	targetOrgAliases = orgAliases or [orgAlias]
+	fingerprint = checkpointJournal.getFingerprint(checkpointJournal.getFileStats(allFilePaths), targetOrgAliases, validObjects, csvDirectory, csvEngineName, fields, keyPattern, shardSize)
+	journalPath = checkpointJournal.getJournalPath(checkpointDirectory, f'upsert.{",".join(targetOrgAliases)}')
+	journal = checkpointJournal.CheckpointJournal(journalPath, fingerprint, resume)
+
+
+def convertAndUpsert():
 	consolidateFilePaths()
+	openJournal()
 	prepForConversion()
 	convertToCsvs()
-	addRecordTypeIds()
+	planUpsertOrder()
 
 	printPaths()
 
+	if orgAliases:
+		failedOrgAliases = deployToOrgs()
+		deleteTempFolder()
+		if failedOrgAliases:
+			util.exitWithFailure(f'Deploy failed for {len(failedOrgAliases)} of {len(orgAliases)} orgs: {", ".join(failedOrgAliases)}. Run again with --resume to continue where each org stopped.')
+		journal.delete()
+		return
+
+	if not journal.isComplete('recordTypes', orgAlias):
+		addRecordTypeIds(orgAlias, csvDirectory)
+		journal.markComplete('recordTypes', orgAlias)
 	if doUpsert:
-		upsertRecords()
+		upsertRecords(orgAlias, upsertSteps, reportFile)
 	
 	deleteTempFolder()
+	journal.delete()
+
+
+def execute():
+	print('\n\n================================================\n==========   UPSERT SALESFORCE CONFIG   ==========\n================================================\n')
+	processParams()
+	convertAndUpsert()
 	
 	print(f'\n\n{SMALL_SPACER}{SMALL_SPACER}{SMALL_SPACER}\n{SMALL_SPACER} PROCESS COMPLETE! {SMALL_SPACER}\n{SMALL_SPACER}{SMALL_SPACER}{SMALL_SPACER}')
 
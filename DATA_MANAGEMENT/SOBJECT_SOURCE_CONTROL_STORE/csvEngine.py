@@ -0,0 +1,132 @@
+# MIT License
+# Copyright (c) 2023 Andrew Hovey
+# Full License Text: https://ahovey.com/MITLicense.html
+# The above abbreviated copyright notice shall be included in all copies or substantial portions of the Software.
+# -----------------------------------------------------
+
+# https://github.com/ahoveynow/SalesforceUtilities/blob/main/DATA_MANAGEMENT/SOBJECT_SOURCE_CONTROL_STORE
+
+# CSV engines used by the hot conversion paths (set with --csvEngine):
+#  - dict (default): csv.DictReader / csv.DictWriter, a dict per row
+#  - fast: positional csv.reader / csv.writer with precomputed column indexes
+#  - arrow: pyarrow.csv for reading (when pyarrow is installed), positional csv.writer for writing
+# All engines produce identical output (see benchmarkCsvEngines.py).
+# Positional rows follow csv.DictReader conventions: blank lines are skipped, short rows are padded with None
+# and values beyond the header are dropped. Every engine reads csvs with openCsv(), so line breaks are handled the same.
+
+import csv
+
+try:
+	import pyarrow
+	import pyarrow.csv as pyarrowCsv
+	import pyarrow.compute as pyarrowCompute
+except ImportError:
+	pyarrow = None
+
+DICT = 'dict'
+FAST = 'fast'
+ARROW = 'arrow'
+ENGINES = [DICT, FAST, ARROW]
+
+
+def validateEngine(engine):
+	# Returns an error message, or None if the engine can be used
+	if engine not in ENGINES:
+		return f'Expected one of {", ".join(ENGINES)} as value for --csvEngine param.'
+	if engine == ARROW and pyarrow is None:
+		return 'The arrow csv engine requires the pyarrow package (pip install pyarrow).'
+	return None
+
+
+def isPositional(engine):
+	return engine != DICT
+
+
+
+###############
+### READING ###
+
+def openCsv(filePath):
+	# Every engine reads in universal newlines mode (as csv.DictReader always has here), so a CRLF inside a quoted
+	# value (eg. a long text area) reads as "\n" whichever engine is used
+	return open(filePath, encoding='utf8')
+
+
+def readRows(filePath, engine):
+	# Returns (field names, iterable of row lists) for the fast and arrow engines
+	if engine == ARROW:
+		return readRowsWithArrow(filePath)
+	return readRowsWithCsvReader(filePath)
+
+
+def readRowsWithCsvReader(filePath):
+	# Rows are read lazily. The file is closed once every row has been read.
+	csvFileContent = openCsv(filePath)
+	csvReader = csv.reader(csvFileContent)
+	fieldNames = next(csvReader, [])
+	return fieldNames, iterPaddedRows(csvFileContent, csvReader, len(fieldNames))
+
+
+def iterPaddedRows(csvFileContent, csvReader, fieldCount):
+	with csvFileContent:
+		for row in csvReader:
+			if not row:
+				continue # csv.DictReader skips blank lines
+			if len(row) != fieldCount:
+				row = (row + [None] * fieldCount)[:fieldCount]
+			yield row
+
+
+def readRowsWithArrow(filePath):
+	with openCsv(filePath) as csvFileContent:
+		fieldNames = next(csv.reader(csvFileContent), [])
+	if not fieldNames:
+		return fieldNames, []
+	return fieldNames, iterArrowRows(filePath, fieldNames)
+
+
+def iterArrowRows(filePath, fieldNames):
+	# The csv is streamed one record batch at a time, so only one batch is held as python values
+	columnNames = [f'column{index}' for index in range(len(fieldNames))]
+	yieldedRowCount = 0
+	try:
+		# Every column is read as a string, and no value (eg. "#N/A", "null" or "") is converted to null
+		batchReader = pyarrowCsv.open_csv(
+			filePath,
+			read_options = pyarrowCsv.ReadOptions(column_names = columnNames, skip_rows = 1),
+			parse_options = pyarrowCsv.ParseOptions(newlines_in_values = True),
+			convert_options = pyarrowCsv.ConvertOptions(
+				column_types = {columnName: pyarrow.string() for columnName in columnNames},
+				strings_can_be_null = False,
+				quoted_strings_can_be_null = False,
+			),
+		)
+		for batch in batchReader:
+			columns = [normalizeArrowNewlines(column).to_pylist() for column in batch.columns]
+			for row in zip(*columns):
+				yield list(row)
+				yieldedRowCount += 1
+	except pyarrow.ArrowInvalid:
+		# pyarrow can't pad short rows (or drop extra values) as csv.DictReader does, so the rest of the csv is read with csv.reader
+		fieldNames, csvRows = readRowsWithCsvReader(filePath)
+		for rowIndex, csvRow in enumerate(csvRows):
+			if rowIndex >= yieldedRowCount:
+				yield csvRow
+
+
+def normalizeArrowNewlines(column):
+	# pyarrow keeps the raw line breaks inside quoted values. They are translated as universal newlines mode does (see openCsv).
+	column = pyarrowCompute.replace_substring(column, '\r\n', '\n')
+	return pyarrowCompute.replace_substring(column, '\r', '\n')
+
+
+
+###############
+### WRITING ###
+
+def writeRows(filePath, fieldNames, rows):
+	# rows are lists in the order of fieldNames. None is written as an empty value, as csv.DictWriter does.
+	with open(filePath, 'w', newline='', encoding='utf8') as csvfile:
+		writer = csv.writer(csvfile)
+		writer.writerow(fieldNames)
+		writer.writerows(rows)
@@ -0,0 +1,78 @@
+# MIT License
+# Copyright (c) 2023 Andrew Hovey
+# Full License Text: https://ahovey.com/MITLicense.html
+# The above abbreviated copyright notice shall be included in all copies or substantial portions of the Software.
+# -----------------------------------------------------
+
+# https://github.com/ahoveynow/SalesforceUtilities/blob/main/DATA_MANAGEMENT/SOBJECT_SOURCE_CONTROL_STORE
+
+# Deploy manifests record a hash of every record that was last upserted to an org, so a later plan can tell
+# which records changed in source since that deploy without comparing every field.
+#  - One manifest per org and object: {manifestDirectory}/{orgAlias}/{objectName}.tsv
+#  - One line per record: "{manifest key}\t{record hash}", sorted by manifest key
+#  - The manifest key is the record's escaped file name (util.keyToFileName), which never contains tabs or line breaks
+# Manifests are always read and written in sorted order, so they can be merged and compared as streams
+# without loading every record into memory.
+
+import os
+import json
+import util
+import hashlib
+
+
+def getManifestKey(key):
+	return util.keyToFileName(key)
+
+
+def getManifestPath(manifestDirectory, orgAlias, objectName):
+	return f'{manifestDirectory}/{orgAlias}/{objectName}.tsv'
+
+
+def hashRecord(record):
+	# __SObjectType and __upsertField aren't fields in the org, so they aren't part of the hash
+	fields = {fieldName: fieldValue for fieldName, fieldValue in record.items() if not fieldName.startswith('__')}
+	return hashlib.sha1(json.dumps(fields, sort_keys = True, separators = (',', ':')).encode('utf8')).hexdigest()
+
+
+
+###########################
+### READ/WRITE MANIFEST ###
+
+def readManifest(manifestPath):
+	# Yields (manifest key, record hash) in sorted order
+	if not os.path.exists(manifestPath):
+		return
+	with open(manifestPath, 'r', encoding='utf8') as manifestFile:
+		for line in manifestFile:
+			manifestKey, recordHash = line.rstrip('\n').split('\t')
+			yield manifestKey, recordHash
+
+
+def writeManifest(manifestPath, sortedEntries):
+	# Written to a temporary file first, so an interrupted write never leaves a partial manifest
+	os.makedirs(os.path.dirname(manifestPath), exist_ok=True)
+	temporaryPath = manifestPath + '.tmp'
+	with open(temporaryPath, 'w', encoding='utf8', newline='\n') as manifestFile:
+		for manifestKey, recordHash in sortedEntries:
+			manifestFile.write(f'{manifestKey}\t{recordHash}\n')
+	os.replace(temporaryPath, manifestPath)
+
+
+def mergeManifest(manifestPath, updatedEntries):
+	# updatedEntries: {manifest key: record hash} for the records that were just upserted. These replace existing entries.
+	sortedUpdates = sorted(updatedEntries.items())
+	writeManifest(manifestPath, mergeSortedEntries(readManifest(manifestPath), iter(sortedUpdates)))
+
+
+def mergeSortedEntries(existingEntries, updatedEntries):
+	existingEntry = next(existingEntries, None)
+	updatedEntry = next(updatedEntries, None)
+	while existingEntry is not None or updatedEntry is not None:
+		if updatedEntry is None or (existingEntry is not None and existingEntry[0] < updatedEntry[0]):
+			yield existingEntry
+			existingEntry = next(existingEntries, None)
+		else:
+			if existingEntry is not None and existingEntry[0] == updatedEntry[0]:
+				existingEntry = next(existingEntries, None) # Replaced by the update
+			yield updatedEntry
+			updatedEntry = next(updatedEntries, None)
@@ -21,6 +21,10 @@ OBJECT_CONFIG = {
 			'Some_Field_B__c',
 			'Some_Json_Field__c',
 			'Related_Record__r.Name',
-		]
+		],
+		'lookupObjects': { # Optional. The object each relationship field looks up, used to determine upsert order.
+			# Only needed when it can't be inferred from the relationship name (eg. Some_Object_2__r looks up Some_Object_2__c)
+			'Related_Record__r': 'Some_Object_2__c',
+		},
 	},
 }
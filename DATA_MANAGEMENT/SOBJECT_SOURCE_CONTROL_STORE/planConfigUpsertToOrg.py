@@ -0,0 +1,367 @@
+# MIT License
+# Copyright (c) 2023 Andrew Hovey
+# Full License Text: https://ahovey.com/MITLicense.html
+# The above abbreviated copyright notice shall be included in all copies or substantial portions of the Software.
+# -----------------------------------------------------
+
+# https://github.com/ahoveynow/SalesforceUtilities/blob/main/DATA_MANAGEMENT/SOBJECT_SOURCE_CONTROL_STORE
+
+# Shows what an upsert would change in the org, without upserting anything.
+# Three sides are compared for every record in source:
+#  - source: the json records in {sourceFolder}/{objectName}
+#  - last deploy: the hashes written to {manifestDirectory}/{orgAlias} by convertSourceToCsvAndUpsertToOrg.py
+#  - org: the current values queried from the org
+# Each record is reported as an insert, an update (with the fields that would change) or a no-op.
+# Updates are flagged when the org was changed since the last deploy (the upsert would overwrite that change).
+#
+# By default, only records that changed in source since the last deploy are queried from the org (in chunks of
+# --maxKeysPerQuery keys). The rest are reported as not compared: the upsert re-sends them too, so any change made
+# in the org since the last deploy would be overwritten without showing in the plan. Use --fullCompare true to query every record.
+# All sides are compared as streams sorted by key, so only the keys (and the records that differ) are held in memory.
+
+# USAGE (from repo root):
+# python dataConfig/__scripts/planConfigUpsertToOrg.py
+#	--orgAlias mySampleOrg
+#	--objects "Some_Object_1__c, Some_Object_2__c"
+#	--reportFile dataConfig/__csv/plan.json
+
+import os
+import csv
+import json
+import util
+import deployManifest
+import convertCsvToSource
+
+from objectConfig import OBJECT_CONFIG
+
+validObjects = OBJECT_CONFIG
+
+SMALL_SPACER = '==============='
+MAX_PRINTED_VALUE_LENGTH = 80
+
+# Params
+orgAlias = 'mySampleOrg'						# the sfdx org alias
+sourceFolder = 'dataConfig'						# directory where the source control config records reside
+csvDirectory = 'dataConfig/__csv'				# directory where the queried org csv files will be stored
+manifestDirectory = 'dataConfig/__manifests'	# directory where convertSourceToCsvAndUpsertToOrg.py stores the last deployed hashes
+sfdxCommand = 'sfdx'							# some installations use a different reference to sfdx
+objects = list(validObjects.keys())				# Passed as a comma-separated list of object API names to be planned
+fullCompare = False								# True to compare every record with the org, rather than only the records changed since the last deploy
+maxKeysForPartialPull = 2000					# When more records than this changed, every record is queried (a full pull is faster than many small queries)
+maxKeysPerQuery = 100							# Keys per query when only changed records are queried
+reportFile = None								# Optional path of a json report of the plan
+
+# Other variables
+plan = {}
+
+
+######################
+### PROCESS PARAMS ###
+
+def processParams():
+	global orgAlias, sourceFolder, csvDirectory, manifestDirectory, sfdxCommand, objects, fullCompare, maxKeysForPartialPull, maxKeysPerQuery, reportFile
+	params = util.getArgParams()
+	print('======= PARAMS =======\nThese can be set with full text flag, eg. --orgAlias mySampleOrg\n')
+
+	# orgAlias
+	orgAliasParam = ('orgAlias' in params.keys() and params['orgAlias'])
+	if orgAliasParam:
+		orgAlias = orgAliasParam
+	print(f'orgAlias: {orgAlias}')
+
+	# sourceFolder
+	sourceFolderParam = ('sourceFolder' in params.keys() and params['sourceFolder'])
+	if sourceFolderParam:
+		sourceFolder = sourceFolderParam
+	print(f'sourceFolder: {sourceFolder}')
+
+	# csvDirectory
+	csvDirectoryParam = ('csvDirectory' in params.keys() and params['csvDirectory'])
+	if csvDirectoryParam:
+		csvDirectory = csvDirectoryParam
+	print(f'csvDirectory: {csvDirectory}')
+
+	# manifestDirectory
+	manifestDirectoryParam = ('manifestDirectory' in params.keys() and params['manifestDirectory'])
+	if manifestDirectoryParam:
+		manifestDirectory = manifestDirectoryParam
+	print(f'manifestDirectory: {manifestDirectory}')
+
+	# sfdxCommand
+	sfdxCommandParam = ('sfdxCommand' in params.keys() and params['sfdxCommand'])
+	if sfdxCommandParam:
+		sfdxCommand = sfdxCommandParam
+	print(f'sfdxCommand: {sfdxCommand}')
+
+	# objects
+	objectsParam = ('objects' in params.keys() and params['objects'])
+	if objectsParam:
+		objects = [objectName.strip() for objectName in objectsParam.split(',')]
+		for objectName in objects:
+			if objectName not in validObjects.keys():
+				util.exitWithFailure(f'{objectName} is not supported.')
+	print(f'objects: {",".join(objects)}')
+
+	# fullCompare
+	fullCompareParam = ('fullCompare' in params.keys() and params['fullCompare'])
+	if fullCompareParam and str(fullCompareParam).lower() == 'true':
+		fullCompare = True
+	elif fullCompareParam and str(fullCompareParam).lower() != 'false':
+		util.exitWithFailure('Expected true or false as value for --fullCompare param.')
+	print(f'fullCompare: {fullCompare}')
+
+	# maxKeysForPartialPull
+	maxKeysForPartialPullParam = ('maxKeysForPartialPull' in params.keys() and params['maxKeysForPartialPull'])
+	if maxKeysForPartialPullParam:
+		if not str(maxKeysForPartialPullParam).isdigit():
+			util.exitWithFailure('Expected a whole number as value for --maxKeysForPartialPull param.')
+		maxKeysForPartialPull = int(maxKeysForPartialPullParam)
+	print(f'maxKeysForPartialPull: {maxKeysForPartialPull}')
+
+	# maxKeysPerQuery
+	maxKeysPerQueryParam = ('maxKeysPerQuery' in params.keys() and params['maxKeysPerQuery'])
+	if maxKeysPerQueryParam:
+		if not str(maxKeysPerQueryParam).isdigit() or int(maxKeysPerQueryParam) == 0:
+			util.exitWithFailure('Expected a positive whole number as value for --maxKeysPerQuery param.')
+		maxKeysPerQuery = int(maxKeysPerQueryParam)
+	print(f'maxKeysPerQuery: {maxKeysPerQuery}')
+
+	# reportFile
+	reportFileParam = ('reportFile' in params.keys() and params['reportFile'])
+	if reportFileParam:
+		reportFile = reportFileParam
+	print(f'reportFile: {reportFile}')
+
+	print(f'\n{SMALL_SPACER}\n')
+
+
+
+##############
+### SOURCE ###
+
+def listSourceEntries(objectName):
+	# Returns [(manifest key, file path, record hash)] sorted by manifest key.
+	# Records are parsed one at a time; only their hashes are kept.
+	objectFolder = f'{sourceFolder}/{objectName}'
+	if not os.path.isdir(objectFolder):
+		return []
+
+	sourceEntries = []
+	for fileName in os.listdir(objectFolder):
+		if not fileName.lower().endswith('.json'):
+			continue
+		filePath = f'{objectFolder}/{fileName}'
+		manifestKey = deployManifest.getManifestKey(util.fileNameToKey(fileName[:-5])) # remove ".json" (5 characters)
+		sourceEntries.append((manifestKey, filePath, deployManifest.hashRecord(loadJson(filePath))))
+	sourceEntries.sort()
+	return sourceEntries
+
+
+def loadJson(filePath):
+	with open(filePath, 'r', encoding='utf8') as file:
+		return json.load(file)
+
+
+def addLastDeployedHashes(objectName, sourceEntries):
+	# Returns [(manifest key, file path, source hash, last deployed hash or None)], still sorted by manifest key
+	entries = []
+	manifestEntries = deployManifest.readManifest(deployManifest.getManifestPath(manifestDirectory, orgAlias, objectName))
+	manifestEntry = next(manifestEntries, None)
+	for manifestKey, filePath, sourceHash in sourceEntries:
+		while manifestEntry is not None and manifestEntry[0] < manifestKey:
+			manifestEntry = next(manifestEntries, None)
+		manifestHash = manifestEntry[1] if manifestEntry is not None and manifestEntry[0] == manifestKey else None
+		entries.append((manifestKey, filePath, sourceHash, manifestHash))
+	return entries
+
+
+
+###########
+### ORG ###
+
+def queryOrgRecords(objectDetails, manifestKeys):
+	# Queries the org into {csvDirectory}/__plan/{objectName}.csv. manifestKeys = None queries every record.
+	os.makedirs(f'{csvDirectory}/__plan', exist_ok=True)
+	csvFileName = f'{csvDirectory}/__plan/{objectDetails["name"]}.csv'
+	selectClause = f'SELECT {",".join(objectDetails["fields"])} FROM {objectDetails["name"]}'
+
+	queries = []
+	if manifestKeys is None:
+		queries.append(f'{selectClause} {objectDetails["whereClause"]}')
+	else:
+		for index in range(0, len(manifestKeys), maxKeysPerQuery):
+			quotedKeys = [quoteSoqlString(util.fileNameToKey(manifestKey)) for manifestKey in manifestKeys[index:index + maxKeysPerQuery]]
+			queries.append(f'{selectClause} WHERE {objectDetails["upsertField"]} IN ({",".join(quotedKeys)})')
+
+	headerWritten = False
+	with open(csvFileName, 'w', encoding='utf8', newline='') as fileWriter:
+		for query in queries:
+			print(f'Querying {objectDetails["name"]}: {query[:200]}{"..." if len(query) > 200 else ""}')
+			completedProcess = util.runCommand([sfdxCommand, 'force:data:soql:query', '--result-format', 'csv', '--wait', '10', '-u', orgAlias, '--query', query])
+			if completedProcess.returncode != 0:
+				print(completedProcess.stderr)
+				util.exitWithFailure(f'Could not query {objectDetails["name"]} from org {orgAlias}.')
+
+			# Remove warnings, and the header of every query but the first
+			csvLines = completedProcess.stdout.splitlines(keepends=True)
+			startOfFileFound = False
+			for line in csvLines:
+				if not startOfFileFound and line.startswith('Warning:'):
+					continue
+				if not startOfFileFound:
+					startOfFileFound = True
+					if headerWritten:
+						continue
+					headerWritten = True
+				fileWriter.write(line)
+	return csvFileName
+
+
+def quoteSoqlString(value):
+	return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def iterOrgRecords(objectDetails, orgCsvFileName):
+	# Yields (row number, manifest key, record) with values converted the same way a pull would store them
+	jsonFields = objectDetails.get('jsonFields') or []
+	upsertField = objectDetails['upsertField']
+	with open(orgCsvFileName, 'r', encoding='utf8', newline='') as csvFileContent:
+		for rowNumber, csvRow in enumerate(csv.DictReader(csvFileContent)):
+			record = convertCsvToSource.normalizeCsvRow(csvRow, jsonFields)
+			yield rowNumber, deployManifest.getManifestKey(record.get(upsertField) or ''), record
+
+
+def listOrgEntries(objectDetails, orgCsvFileName):
+	# Returns [(manifest key, record hash, row number)] sorted by manifest key
+	orgEntries = []
+	for rowNumber, manifestKey, record in iterOrgRecords(objectDetails, orgCsvFileName):
+		orgEntries.append((manifestKey, deployManifest.hashRecord(record), rowNumber))
+	orgEntries.sort()
+	return orgEntries
+
+
+
+###############
+### COMPARE ###
+
+def planObject(objectName):
+	objectDetails = validObjects[objectName]
+	objectPlan = {'inserts': [], 'updates': [], 'noOps': 0, 'notComparedUnchangedSinceLastDeploy': 0, 'notInSource': 0, 'compared': 'all'}
+	plan[objectName] = objectPlan
+
+	sourceEntries = addLastDeployedHashes(objectName, listSourceEntries(objectName))
+	changedManifestKeys = [manifestKey for manifestKey, filePath, sourceHash, manifestHash in sourceEntries if sourceHash != manifestHash]
+	print(f'{objectName}: {len(sourceEntries)} record(s) in source, {len(changedManifestKeys)} changed since the last deploy to {orgAlias}')
+
+	comparedManifestKeys = None # None means every key was queried
+	if not fullCompare and len(changedManifestKeys) <= maxKeysForPartialPull:
+		comparedManifestKeys = set(changedManifestKeys)
+		objectPlan['compared'] = 'changedSinceLastDeploy'
+	if comparedManifestKeys is not None and not comparedManifestKeys:
+		objectPlan['notComparedUnchangedSinceLastDeploy'] = len(sourceEntries)
+		return
+
+	orgCsvFileName = queryOrgRecords(objectDetails, None if comparedManifestKeys is None else changedManifestKeys)
+	orgEntries = listOrgEntries(objectDetails, orgCsvFileName)
+
+	# Merge the sorted source and org entries
+	updateCandidates = {}	# org row number -> (manifest key, source file path, last deployed hash)
+	orgIndex = 0
+	for manifestKey, filePath, sourceHash, manifestHash in sourceEntries:
+		while orgIndex < len(orgEntries) and orgEntries[orgIndex][0] < manifestKey:
+			orgIndex += 1
+			objectPlan['notInSource'] += 1
+		if comparedManifestKeys is not None and manifestKey not in comparedManifestKeys:
+			objectPlan['notComparedUnchangedSinceLastDeploy'] += 1 # Unchanged in source since the last deploy, so not queried
+		elif orgIndex >= len(orgEntries) or orgEntries[orgIndex][0] != manifestKey:
+			objectPlan['inserts'].append({'key': util.fileNameToKey(manifestKey), 'sourceFile': filePath})
+		elif orgEntries[orgIndex][1] == sourceHash:
+			objectPlan['noOps'] += 1
+		else:
+			updateCandidates[orgEntries[orgIndex][2]] = (manifestKey, filePath, manifestHash)
+		while orgIndex < len(orgEntries) and orgEntries[orgIndex][0] == manifestKey:
+			orgIndex += 1
+	objectPlan['notInSource'] += len(orgEntries) - orgIndex
+
+	# Compare the fields of the records that differ (a second pass, so only these org records are held in memory)
+	for rowNumber, manifestKey, orgRecord in iterOrgRecords(objectDetails, orgCsvFileName):
+		if rowNumber not in updateCandidates:
+			continue
+		manifestKey, filePath, manifestHash = updateCandidates[rowNumber]
+		fieldChanges = compareFields(loadJson(filePath), orgRecord)
+		if not fieldChanges:
+			objectPlan['noOps'] += 1
+			continue
+		orgHash = deployManifest.hashRecord(orgRecord)
+		objectPlan['updates'].append({
+			'key': util.fileNameToKey(manifestKey),
+			'sourceFile': filePath,
+			'orgChangedSinceLastDeploy': manifestHash is not None and manifestHash != orgHash,
+			'fields': fieldChanges,
+		})
+
+
+def compareFields(sourceRecord, orgRecord):
+	fieldChanges = []
+	for fieldName, sourceValue in sorted(sourceRecord.items()):
+		if fieldName.startswith('__') or fieldName not in orgRecord:
+			continue # Meta fields and fields that aren't queried aren't upserted
+		if orgRecord[fieldName] != sourceValue:
+			fieldChanges.append({'field': fieldName, 'org': orgRecord[fieldName], 'source': sourceValue})
+	return fieldChanges
+
+
+
+##############
+### REPORT ###
+
+def formatValue(value):
+	if not isinstance(value, str):
+		value = json.dumps(value)
+	value = repr(value)
+	return value if len(value) <= MAX_PRINTED_VALUE_LENGTH else value[:MAX_PRINTED_VALUE_LENGTH - 3] + '...'
+
+
+def printPlan():
+	print(f'\n\n===== PLAN ({orgAlias}) =====\n')
+	for objectName, objectPlan in plan.items():
+		print(f'{SMALL_SPACER}\n{objectName}: {len(objectPlan["inserts"])} insert(s), {len(objectPlan["updates"])} update(s), {objectPlan["noOps"]} no-op(s)\n{SMALL_SPACER}')
+		for insert in objectPlan['inserts']:
+			print(f'+ INSERT {insert["key"]}')
+		for update in objectPlan['updates']:
+			print(f'~ UPDATE {update["key"]}' + (' (changed in org since the last deploy; the upsert will overwrite it)' if update['orgChangedSinceLastDeploy'] else ''))
+			for fieldChange in update['fields']:
+				print(f'    {fieldChange["field"]}: {formatValue(fieldChange["org"])} -> {formatValue(fieldChange["source"])}')
+		if objectPlan['notComparedUnchangedSinceLastDeploy']:
+			print(f'{objectPlan["notComparedUnchangedSinceLastDeploy"]} record(s) unchanged in source since the last deploy were not compared with the org. Org drift was not checked for them (the upsert re-sends them, overwriting any changes made in the org). Use --fullCompare true to check them.')
+		if objectPlan['compared'] == 'all' and objectPlan['notInSource']:
+			print(f'{objectPlan["notInSource"]} record(s) in the org are not in source (the upsert leaves them unchanged)')
+		print('')
+
+	if reportFile:
+		reportDirectory = os.path.dirname(reportFile)
+		if reportDirectory:
+			os.makedirs(reportDirectory, exist_ok=True)
+		with open(reportFile, 'w', encoding='utf8') as fileToWrite:
+			json.dump({'orgAlias': orgAlias, 'objects': plan}, fileToWrite, indent = '\t')
+		print(f'Plan report: {reportFile}')
+
+
+
+###############
+### EXECUTE ###
+
+def execute():
+	print('\n\n================================================\n==========   PLAN SALESFORCE CONFIG   ==========\n================================================\n')
+	processParams()
+
+	for validObjectName in validObjects.keys():
+		if validObjectName in objects:
+			planObject(validObjectName)
+
+	printPlan()
+	print(f'\n\n{SMALL_SPACER}{SMALL_SPACER}{SMALL_SPACER}\n{SMALL_SPACER} PROCESS COMPLETE! {SMALL_SPACER}\n{SMALL_SPACER}{SMALL_SPACER}{SMALL_SPACER}')
+
+
+if __name__ == '__main__':
+	execute()
@@ -17,9 +17,14 @@
 #	--csvDirectory ../__csv
 #	--destinationFolder ../
 #	--objects "Some_Object_1__c, Some_Object_2__c"
+#	--snapshotStore ../configSnapshots	(optional: also archive the pulled records, see snapshotStore.py)
+#	--csvEngine fast	(optional: dict (default), fast or arrow, see csvEngine.py)
+#	--resume	(optional: continue a failed pull, skipping the objects that were already queried or converted, see checkpointJournal.py)
 
 import os
 import util
+import snapshotStore
+import checkpointJournal
 import convertCsvToSource
 
 from objectConfig import OBJECT_CONFIG
@@ -34,6 +39,14 @@ orgAlias = 'mySampleOrg'					# the sfdx org alias
 csvDirectory = 'dataConfig/__csv'			# directory where the intermediate csv files will be stored
 destinationFolder = 'dataConfig'			# directory where the source control config records will reside
 objects = validObjects.keys()				# Passed as a comma-separated list of object API names to be processed (enclose in quotes if spaces are used). This becomes an array when params are processed.
+csvEngineName = 'dict'						# dict (default), fast or arrow. See csvEngine.py
+snapshotStoreDirectory = None				# Optional. Directory of a content-addressed snapshot store. When set, every pull is archived as a snapshot.
+resume = False								# True to continue a failed pull from its checkpoint journal, skipping the objects that were already queried or converted
+checkpointDirectory = 'dataConfig/__checkpoints'	# directory where the checkpoint journals of runs are stored
+
+# Other variables
+snapshotHashesByObject = {}
+journal = None
 
 
 
@@ -41,7 +54,7 @@ objects = validObjects.keys()				# Passed as a comma-separated list of object AP
 ### PROCESS PARAMS ###
 
 def processParams():
-	global orgAlias, csvDirectory, objects, destinationFolder
+	global orgAlias, csvDirectory, objects, destinationFolder, snapshotStoreDirectory, csvEngineName, resume, checkpointDirectory
 	params = util.getArgParams()
 	print('======= PARAMS =======\nThese can be set with full text flag, eg. --orgAlias mySampleOrg\n')
 
@@ -71,6 +84,30 @@ def processParams():
 			objects[index] = object.strip()
 	print(f'objects: {",".join(objects)}')
 
+	# csvEngine
+	csvEngineParam = ('csvEngine' in params.keys() and params['csvEngine'])
+	if csvEngineParam:
+		csvEngineName = csvEngineParam
+	print(f'csvEngine: {csvEngineName}')
+
+	# snapshotStore
+	snapshotStoreParam = ('snapshotStore' in params.keys() and params['snapshotStore'])
+	if snapshotStoreParam:
+		snapshotStoreDirectory = snapshotStoreParam
+	print(f'snapshotStore: {snapshotStoreDirectory}')
+
+	# resume
+	resumeParam = ('resume' in params.keys() and params['resume'])
+	if resumeParam is True or (resumeParam and resumeParam.lower() == 'true'):
+		resume = True
+	print(f'resume: {resume}')
+
+	# checkpointDirectory
+	checkpointDirectoryParam = ('checkpointDirectory' in params.keys() and params['checkpointDirectory'])
+	if checkpointDirectoryParam:
+		checkpointDirectory = checkpointDirectoryParam
+	print(f'checkpointDirectory: {checkpointDirectory}')
+
 	print(f'\n{SMALL_SPACER}\n')
 
 
@@ -109,7 +146,8 @@ def queryRecords(objectDetails):
 	csvFileName = f'{csvDirectory}/{objectDetails["name"]}.csv'
 	queryCommand = f'sfdx force:data:soql:query --result-format csv --wait 10 -u {orgAlias} --query "SELECT {",".join(objectDetails["fields"])} FROM {objectDetails["name"]} {objectDetails["whereClause"]} " > "{csvFileName}"'
 	print(queryCommand)
-	os.system(queryCommand)
+	if os.system(queryCommand) != 0:
+		util.exitWithFailure(f'Could not query {objectDetails["name"]} records from org {orgAlias}. Run again with --resume to continue from this object.')
 
 	# Remove warnings
 	csvLines = []
@@ -144,10 +182,67 @@ def convertCsvToSourceForObject(objectDetails):
 		'destinationFolder': f'{destinationFolder}/{objectDetails["name"]}',
 		'upsertField': objectDetails["upsertField"],
 		'objectName': objectDetails["name"],
-		'jsonFields': jsonFields
+		'jsonFields': jsonFields,
+		'csvEngine': csvEngineName,
 	}
 	convertCsvToSource.execute(parameters)
 
+	if snapshotStoreDirectory:
+		snapshotHashesByObject[objectName] = snapshotStore.storeFiles(snapshotStoreDirectory, convertCsvToSource.writtenFilePaths)
+
+
+
+
+##########################
+### CHECKPOINT JOURNAL ###
+
+def openJournal():
+	# The journal is only resumed when the same objects are pulled from the same org with the same config and params
+	global journal
+	objectNames = [objectName for objectName in validObjects.keys() if objectName in objects]
+	fingerprint = checkpointJournal.getFingerprint(orgAlias, [validObjects[objectName] for objectName in objectNames], csvDirectory, destinationFolder, csvEngineName, snapshotStoreDirectory)
+	journal = checkpointJournal.CheckpointJournal(checkpointJournal.getJournalPath(checkpointDirectory, f'pull.{orgAlias}'), fingerprint, resume)
+
+
+def getCsvFileState(csvFilePath):
+	# Modified time and size, as stored in the journal (a list, since json has no tuples)
+	if not os.path.exists(csvFilePath):
+		return None
+	csvFileStat = os.stat(csvFilePath)
+	return [csvFileStat.st_mtime_ns, csvFileStat.st_size]
+
+
+def pullObject(objectDetails):
+	objectName = objectDetails['name']
+	if journal.isComplete('convert', objectName):
+		print(f'{objectName} was already pulled (resumed).')
+		snapshotHashes = journal.getDetails('convert', objectName)
+		if snapshotHashes is not None:
+			snapshotHashesByObject[objectName] = snapshotHashes
+		return
+
+	# The csv is only reused if it is the one the query wrote. Other scripts write to the same csv directory
+	# (eg. an upsert between the failed pull and --resume writes upload-format csvs with the same names).
+	csvFilePath = f'{csvDirectory}/{objectName}.csv'
+	if journal.isComplete('query', objectName) and journal.getDetails('query', objectName) == getCsvFileState(csvFilePath):
+		print(f'{objectName} was already queried (resumed).')
+	else:
+		queryRecords(objectDetails)
+		journal.markComplete('query', objectName, details = getCsvFileState(csvFilePath))
+
+	convertCsvToSourceForObject(objectDetails)
+	journal.markComplete('convert', objectName, details = snapshotHashesByObject.get(objectName))
+
+
+
+
+######################
+### WRITE SNAPSHOT ###
+
+def writeSnapshot():
+	snapshotId = snapshotStore.writeSnapshot(snapshotStoreDirectory, orgAlias, snapshotHashesByObject)
+	print(f'Snapshot written: {snapshotId} (restore with: python snapshotStore.py --snapshotStore {snapshotStoreDirectory} --restore {snapshotId})')
+
 
 
 
@@ -158,6 +253,7 @@ def execute():
 	print('\n\n================================================\n==========   PULL SALESFORCE CONFIG   ==========\n================================================\n')
 	processParams()
 	validateObjects()
+	openJournal()
 
 	currentIndex = 0
 	print('Processing Objects...')
@@ -165,8 +261,11 @@ def execute():
 		if validObjectName in objects:
 			currentIndex += 1
 			print(f'{SMALL_SPACER}\nOBJECT {currentIndex} of {len(objects)}: {validObjectName}\n{SMALL_SPACER}\n')
-			queryRecords(validObjects[validObjectName])
-			convertCsvToSourceForObject(validObjects[validObjectName])
+			pullObject(validObjects[validObjectName])
+
+	if snapshotStoreDirectory:
+		writeSnapshot()
+	journal.delete()
 	
 	print(f'\n\n{SMALL_SPACER}{SMALL_SPACER}{SMALL_SPACER}\n{SMALL_SPACER} PROCESS COMPLETE! {SMALL_SPACER}\n{SMALL_SPACER}{SMALL_SPACER}{SMALL_SPACER}')
 
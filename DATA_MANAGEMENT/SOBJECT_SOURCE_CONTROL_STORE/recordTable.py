@@ -0,0 +1,78 @@
+# MIT License
+# Copyright (c) 2023 Andrew Hovey
+# Full License Text: https://ahovey.com/MITLicense.html
+# The above abbreviated copyright notice shall be included in all copies or substantial portions of the Software.
+# -----------------------------------------------------
+
+# https://github.com/ahoveynow/SalesforceUtilities/blob/main/DATA_MANAGEMENT/SOBJECT_SOURCE_CONTROL_STORE
+
+# Compact in-memory storage for the records of one object.
+# A dict per record repeats every field name and carries a hash table, which dominates memory for large objects.
+# A RecordTable stores the field names once (interned, shared by every row) and each record as a tuple of values.
+# Values that are the same for every record (eg. __SObjectType) are stored once as constant fields.
+# Records are only turned into dicts at the json/csv boundary (toDict / iterDicts).
+
+import sys
+
+MISSING = object()	# Marks a field that a record doesn't have (rows may also be shorter than the field list)
+
+
+class RecordTable:
+
+	def __init__(self, constantFields = None):
+		self.fieldNames = []
+		self.fieldIndexes = {}
+		self.constantFields = dict(constantFields or {})
+		self.rows = []
+
+
+	def __len__(self):
+		return len(self.rows)
+
+
+	def __iter__(self):
+		return iter(self.rows)
+
+
+	def getFieldIndex(self, fieldName):
+		# Adds the field to the table if it isn't there yet
+		fieldIndex = self.fieldIndexes.get(fieldName)
+		if fieldIndex is None:
+			fieldName = sys.intern(fieldName)
+			fieldIndex = len(self.fieldNames)
+			self.fieldNames.append(fieldName)
+			self.fieldIndexes[fieldName] = fieldIndex
+		return fieldIndex
+
+
+	def appendValues(self, values):
+		# values are positional, in the order of fieldNames
+		self.rows.append(tuple(values))
+
+
+	def appendRecord(self, record):
+		for fieldName in record.keys():
+			if fieldName not in self.fieldIndexes:
+				self.getFieldIndex(fieldName)
+		self.rows.append(tuple(record.get(fieldName, MISSING) for fieldName in self.fieldNames))
+
+
+	def getValue(self, row, fieldName, default = None):
+		if fieldName in self.constantFields:
+			return self.constantFields[fieldName]
+		fieldIndex = self.fieldIndexes.get(fieldName)
+		if fieldIndex is None or fieldIndex >= len(row) or row[fieldIndex] is MISSING:
+			return default
+		return row[fieldIndex]
+
+
+	def toDict(self, row, includeConstantFields = True):
+		record = {fieldName: value for fieldName, value in zip(self.fieldNames, row) if value is not MISSING}
+		if includeConstantFields:
+			record.update(self.constantFields)
+		return record
+
+
+	def iterDicts(self, includeConstantFields = True):
+		for row in self.rows:
+			yield self.toDict(row, includeConstantFields)
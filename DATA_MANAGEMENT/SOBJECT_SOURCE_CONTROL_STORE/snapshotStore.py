@@ -0,0 +1,220 @@
+# MIT License
+# Copyright (c) 2023 Andrew Hovey
+# Full License Text: https://ahovey.com/MITLicense.html
+# The above abbreviated copyright notice shall be included in all copies or substantial portions of the Software.
+# -----------------------------------------------------
+
+# https://github.com/ahoveynow/SalesforceUtilities/blob/main/DATA_MANAGEMENT/SOBJECT_SOURCE_CONTROL_STORE
+
+# Content-addressed snapshot archive of pulled config records.
+#  - Every record file is stored once, compressed, under objects/{first 2 hash characters}/{rest of the sha256 hash}.
+#    Unchanged records are already in the store, so each pull only adds the records that changed.
+#  - Each snapshot is a small json manifest (snapshots/{orgAlias}/{snapshot name}.json) mapping
+#    object name -> record file name -> hash.
+#  - Records are compressed with zstd when the zstandard package is installed, otherwise gzip.
+#    Either can be read back regardless of which is installed when restoring (as long as zstd blobs have zstandard).
+#
+# pullConfigAndConvertToSource.py writes a snapshot when --snapshotStore is set.
+
+# USAGE (from repo root):
+# python dataConfig/__scripts/snapshotStore.py --snapshotStore ../configSnapshots --list
+# python dataConfig/__scripts/snapshotStore.py
+#	--snapshotStore ../configSnapshots
+#	--restore mySampleOrg/20230101-120000
+#	--destinationFolder dataConfig
+#	--clean true	(optional: removes existing json records from the restored object folders first)
+
+import os
+import gzip
+import json
+import time
+import util
+import hashlib
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+GZIP_MAGIC = b'\x1f\x8b'
+
+SMALL_SPACER = '==============='
+
+# Params
+snapshotStore = None				# root directory of the snapshot store
+restore = None						# snapshot to restore, as {orgAlias}/{snapshot name}. Snapshots are listed when not set.
+destinationFolder = 'dataConfig'	# directory the snapshot is restored to (one folder per object)
+clean = False						# True to remove existing json records from the restored object folders before restoring
+
+
+#############
+### BLOBS ###
+
+def getBlobPath(storeDirectory, contentHash):
+	return f'{storeDirectory}/objects/{contentHash[:2]}/{contentHash[2:]}'
+
+
+def compress(content):
+	if zstandard:
+		return zstandard.ZstdCompressor().compress(content)
+	return gzip.compress(content, mtime = 0)
+
+
+def decompress(compressedContent):
+	if compressedContent.startswith(ZSTD_MAGIC):
+		if not zstandard:
+			util.exitWithFailure('This snapshot contains zstd-compressed records. Install the zstandard package to restore it.')
+		return zstandard.ZstdDecompressor().decompress(compressedContent)
+	if compressedContent.startswith(GZIP_MAGIC):
+		return gzip.decompress(compressedContent)
+	return compressedContent
+
+
+def storeBlob(storeDirectory, content):
+	# Returns the hash of the content. Content that is already in the store isn't written again.
+	contentHash = hashlib.sha256(content).hexdigest()
+	blobPath = getBlobPath(storeDirectory, contentHash)
+	if not os.path.exists(blobPath):
+		os.makedirs(os.path.dirname(blobPath), exist_ok=True)
+		writeAtomically(blobPath, compress(content))
+	return contentHash
+
+
+def readBlob(storeDirectory, contentHash):
+	with open(getBlobPath(storeDirectory, contentHash), 'rb') as blobFile:
+		return decompress(blobFile.read())
+
+
+def writeAtomically(filePath, content):
+	temporaryPath = f'{filePath}.{os.getpid()}.tmp'
+	with open(temporaryPath, 'wb') as fileToWrite:
+		fileToWrite.write(content)
+	os.replace(temporaryPath, filePath)
+
+
+
+#################
+### SNAPSHOTS ###
+
+def storeFiles(storeDirectory, filePaths):
+	# Returns {file name: hash} for the given record files
+	hashesByFileName = {}
+	for filePath in filePaths:
+		with open(filePath, 'rb') as fileToRead:
+			hashesByFileName[os.path.basename(filePath)] = storeBlob(storeDirectory, fileToRead.read())
+	return hashesByFileName
+
+
+def writeSnapshot(storeDirectory, orgAlias, hashesByObject):
+	# hashesByObject: {objectName: {file name: hash}}
+	# Names go down to the millisecond, and an existing snapshot is never overwritten (a suffix is added instead),
+	# so two pulls of the same org in the same moment both keep their snapshot
+	createdTime = time.time()
+	snapshotName = time.strftime('%Y%m%d-%H%M%S', time.gmtime(createdTime)) + f'-{int(createdTime * 1000) % 1000:03d}'
+	snapshotDirectory = f'{storeDirectory}/snapshots/{orgAlias}'
+	os.makedirs(snapshotDirectory, exist_ok=True)
+	snapshot = {'orgAlias': orgAlias, 'createdDate': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(createdTime)), 'objects': hashesByObject}
+
+	temporaryPath = f'{snapshotDirectory}/{snapshotName}.{os.getpid()}.tmp'
+	with open(temporaryPath, 'wb') as fileToWrite:
+		fileToWrite.write(json.dumps(snapshot, indent = '\t', sort_keys = True).encode('utf8'))
+	suffix = 1
+	uniqueSnapshotName = snapshotName
+	while True:
+		try:
+			os.link(temporaryPath, f'{snapshotDirectory}/{uniqueSnapshotName}.json') # Fails if the snapshot exists, unlike os.replace
+			break
+		except FileExistsError:
+			suffix += 1
+			uniqueSnapshotName = f'{snapshotName}-{suffix}'
+	os.remove(temporaryPath)
+	return f'{orgAlias}/{uniqueSnapshotName}'
+
+
+def readSnapshot(storeDirectory, snapshotId):
+	snapshotPath = f'{storeDirectory}/snapshots/{snapshotId}.json'
+	if not os.path.exists(snapshotPath):
+		util.exitWithFailure(f'Snapshot {snapshotId} not found in {storeDirectory}')
+	with open(snapshotPath, 'r', encoding='utf8') as snapshotFile:
+		return json.load(snapshotFile)
+
+
+def restoreSnapshot(storeDirectory, snapshotId, restoreFolder, cleanFolders = False):
+	snapshot = readSnapshot(storeDirectory, snapshotId)
+	for objectName, hashesByFileName in snapshot['objects'].items():
+		objectFolder = f'{restoreFolder}/{objectName}'
+		os.makedirs(objectFolder, exist_ok=True)
+		if cleanFolders:
+			for fileName in os.listdir(objectFolder):
+				if fileName.lower().endswith('.json'):
+					os.remove(f'{objectFolder}/{fileName}')
+		for fileName, contentHash in hashesByFileName.items():
+			with open(f'{objectFolder}/{fileName}', 'wb') as fileToWrite:
+				fileToWrite.write(readBlob(storeDirectory, contentHash))
+		print(f'{objectName}: restored {len(hashesByFileName)} record(s) to {objectFolder}')
+
+
+def listSnapshots(storeDirectory):
+	snapshotsDirectory = f'{storeDirectory}/snapshots'
+	if not os.path.isdir(snapshotsDirectory):
+		print('No snapshots.')
+		return
+	for orgAlias in sorted(os.listdir(snapshotsDirectory)):
+		# Sorted by each part of the name, so a suffixed snapshot (eg. 20240102-030405-678-2) follows the one it was named after
+		for fileName in sorted(os.listdir(f'{snapshotsDirectory}/{orgAlias}'), key = lambda fileName: [namePart.zfill(10) for namePart in fileName.split('.')[0].split('-')]):
+			if not fileName.endswith('.json'):
+				continue
+			snapshot = readSnapshot(storeDirectory, f'{orgAlias}/{fileName[:-5]}')
+			recordCount = sum(len(hashesByFileName) for hashesByFileName in snapshot['objects'].values())
+			print(f'{orgAlias}/{fileName[:-5]}: {len(snapshot["objects"])} object(s), {recordCount} record(s)')
+
+
+
+######################
+### PROCESS PARAMS ###
+
+def processParams():
+	global snapshotStore, restore, destinationFolder, clean
+	params = util.getArgParams()
+
+	# snapshotStore
+	snapshotStore = ('snapshotStore' in params.keys() and params['snapshotStore'])
+	if not snapshotStore or snapshotStore is True:
+		util.exitWithFailure('You must specify the snapshot store directory with the --snapshotStore flag')
+	print(f'snapshotStore: {snapshotStore}')
+
+	# restore
+	restore = ('restore' in params.keys() and params['restore'])
+	if restore:
+		print(f'restore: {restore}')
+
+	# destinationFolder
+	destinationFolderParam = ('destinationFolder' in params.keys() and params['destinationFolder'])
+	if destinationFolderParam:
+		destinationFolder = destinationFolderParam
+	print(f'destinationFolder: {destinationFolder}')
+
+	# clean
+	cleanParam = ('clean' in params.keys() and params['clean'])
+	if cleanParam is True or (cleanParam and cleanParam.lower() == 'true'):
+		clean = True
+	print(f'clean: {clean}')
+
+	print(f'\n{SMALL_SPACER}\n')
+
+
+
+###############
+### EXECUTE ###
+
+def execute():
+	processParams()
+	if restore and restore is not True:
+		restoreSnapshot(snapshotStore, restore, destinationFolder, clean)
+	else:
+		listSnapshots(snapshotStore)
+
+
+if __name__ == '__main__':
+	execute()
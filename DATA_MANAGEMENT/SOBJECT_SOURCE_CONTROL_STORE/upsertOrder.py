@@ -0,0 +1,114 @@
+# MIT License
+# Copyright (c) 2023 Andrew Hovey
+# Full License Text: https://ahovey.com/MITLicense.html
+# The above abbreviated copyright notice shall be included in all copies or substantial portions of the Software.
+# -----------------------------------------------------
+
+# https://github.com/ahoveynow/SalesforceUtilities/blob/main/DATA_MANAGEMENT/SOBJECT_SOURCE_CONTROL_STORE
+
+# Determines the order in which objects are upserted, based on the relationship fields in their csvs.
+# A record can only reference another record (eg. Related_Record__r.Name) once the other record exists in the org,
+# so every object must be upserted after the objects it looks up.
+#  - Objects that look themselves up (eg. Parent_Config__r.Name on the same object) are upserted in two passes:
+#    first without the self lookups, then a second pass that only sets the self lookups.
+#  - Lookups to objects that are not part of the upsert are ignored (those records must already exist in the org).
+#  - Ties are broken by the order of OBJECT_CONFIG, so configs without lookups keep their existing order.
+
+import util
+
+
+##############################
+### RESOLVE LOOKUP OBJECTS ###
+
+def resolveLookupObject(objectName, relationshipName, validObjects):
+	# Explicit mapping in OBJECT_CONFIG takes precedence, eg. 'lookupObjects': {'Related_Record__r': 'Some_Object_2__c'}
+	lookupObjects = validObjects.get(objectName, {}).get('lookupObjects') or {}
+	for configRelationshipName, lookupObjectName in lookupObjects.items():
+		if configRelationshipName.lower() == relationshipName.lower():
+			return lookupObjectName
+
+	# Otherwise infer the object from the relationship name
+	if relationshipName.lower().endswith('__r'):
+		candidateObjectName = relationshipName[:-3] + '__c' # Some_Object__r becomes Some_Object__c
+	elif relationshipName.lower() == 'parent':
+		candidateObjectName = objectName # Standard self lookup, eg. Account.ParentId
+	else:
+		candidateObjectName = relationshipName # Standard lookup, eg. Account.Name
+
+	for validObjectName in validObjects.keys():
+		if validObjectName.lower() == candidateObjectName.lower():
+			return validObjectName
+	return None
+
+
+def getRelationshipNames(fieldNames):
+	relationshipNames = []
+	for fieldName in fieldNames:
+		if '.' in fieldName:
+			relationshipName = fieldName.split('.')[0]
+			if relationshipName not in relationshipNames:
+				relationshipNames.append(relationshipName)
+	return relationshipNames
+
+
+
+##############################
+### BUILD DEPENDENCY GRAPH ###
+
+def buildDependencyGraph(fieldNamesByObject, validObjects):
+	# fieldNamesByObject: {objectName: [csv column names]} for every object being upserted
+	# Returns:
+	#  - dependenciesByObject: {objectName: set of other objects (being upserted) that it looks up}
+	#  - selfRelationshipsByObject: {objectName: [relationship names that look up the same object]}
+	dependenciesByObject = {}
+	selfRelationshipsByObject = {}
+	for objectName, fieldNames in fieldNamesByObject.items():
+		dependenciesByObject[objectName] = set()
+		for relationshipName in getRelationshipNames(fieldNames):
+			lookupObjectName = resolveLookupObject(objectName, relationshipName, validObjects)
+			if lookupObjectName is None or lookupObjectName not in fieldNamesByObject:
+				continue
+			if lookupObjectName == objectName:
+				selfRelationshipsByObject.setdefault(objectName, []).append(relationshipName)
+			else:
+				dependenciesByObject[objectName].add(lookupObjectName)
+	return dependenciesByObject, selfRelationshipsByObject
+
+
+
+############################
+### COMPUTE UPSERT ORDER ###
+
+def computeUpsertOrder(dependenciesByObject, validObjects):
+	configOrder = [objectName for objectName in validObjects.keys() if objectName in dependenciesByObject]
+	remainingDependencies = {objectName: set(dependencies) for objectName, dependencies in dependenciesByObject.items()}
+	upsertOrder = []
+
+	while remainingDependencies:
+		# The first object (in OBJECT_CONFIG order) whose lookups have all been upserted
+		nextObjectName = None
+		for objectName in configOrder:
+			if objectName in remainingDependencies and not remainingDependencies[objectName]:
+				nextObjectName = objectName
+				break
+
+		if nextObjectName is None:
+			cycle = findCycle(remainingDependencies)
+			util.exitWithFailure(f'Objects look each other up in a cycle, so no upsert order works: {" -> ".join(cycle)}\nRemove one of the lookups from the upsert and set it in a separate run.')
+
+		upsertOrder.append(nextObjectName)
+		del remainingDependencies[nextObjectName]
+		for dependencies in remainingDependencies.values():
+			dependencies.discard(nextObjectName)
+
+	return upsertOrder
+
+
+def findCycle(dependenciesByObject):
+	# Every remaining object still has a dependency, so following dependencies must eventually revisit an object
+	path = []
+	objectName = sorted(dependenciesByObject.keys())[0]
+	while objectName not in path:
+		path.append(objectName)
+		objectName = sorted(dependenciesByObject[objectName])[0]
+	return path[path.index(objectName):] + [objectName]
@@ -5,7 +5,11 @@
 # -----------------------------------------------------
 
 
+import os
 import sys
+import json
+import subprocess
+import urllib.parse
 
 params = None
 currentKey = None
@@ -17,7 +21,7 @@ def exitWithFailure(message):
     print('====== FAILURE ======\n')
     print(message)
     print('\n=====================\n\n')
-    quit()
+    raise SystemExit(message) # Carries the message, so callers that keep going (eg. one org of several) can report it
 
 
 
@@ -66,3 +70,92 @@ def getArgParams():
 
     storeCurrentParam()
     return params
+
+
+
+### Commands ###
+# sfdx is a .cmd script on Windows, which can only be resolved through the shell
+def runCommand(command):
+    return subprocess.run(command, capture_output=True, text=True, encoding='utf8', shell=(os.name == 'nt'))
+
+
+def runJsonCommand(command):
+    # Runs a CLI command with --json and returns the parsed output (or None if the output was not valid json).
+    # The CLI returns a non-zero exit code for partial failures, so the output is parsed regardless of the exit code.
+    completedProcess = runCommand(command + ['--json'])
+    try:
+        return json.loads(completedProcess.stdout)
+    except ValueError:
+        print(completedProcess.stdout)
+        print(completedProcess.stderr)
+        return None
+
+
+
+### Lookup fields ###
+# Lookups are stored using a relationship field (eg. Related_Object__r.Name).
+# The lookup field is the field someone would query to get the ID of the related record.
+def getLookupFieldName(relationshipName):
+    if relationshipName.lower().endswith('__r'): # Custom field
+        return relationshipName[:-1] + 'c' # Related_Object__r becomes Related_Object__c
+    return relationshipName + 'Id' # Standard field, eg. Account becomes AccountId
+
+
+
+### Record file names ###
+# Record files are named after the record's upsert key. Keys are not always safe file names, so
+# unsafe characters are percent-encoded (eg. "A/B" becomes "A%2FB"). The encoding is reversible,
+# so the original key can always be recovered from the file name with fileNameToKey().
+# Files named before keys were escaped are recognised by fileNameToKey() and keep their name as their key.
+#  - '%' is the escape character itself, so it is always encoded
+#  - ',' is encoded because file names are passed between scripts as comma-separated lists
+UNSAFE_FILE_NAME_CHARACTERS = set('/\\:*?"<>|%,')
+RESERVED_FILE_NAMES = set(['CON', 'PRN', 'AUX', 'NUL'] + [f'COM{i}' for i in range(1, 10)] + [f'LPT{i}' for i in range(1, 10)])
+
+def escapeFileNameCharacter(character):
+    return ''.join(f'%{byte:02X}' for byte in character.encode('utf8'))
+
+
+def keyToFileName(key, escapeUppercase = False):
+    # escapeUppercase is used for keys that differ from another key only by case.
+    # Encoding the uppercase characters keeps both files distinct on case-insensitive filesystems.
+    fileNameCharacters = []
+    for character in key:
+        if character in UNSAFE_FILE_NAME_CHARACTERS or ord(character) < 32 or ord(character) == 127 or (escapeUppercase and character.isupper()):
+            fileNameCharacters.append(escapeFileNameCharacter(character))
+        else:
+            fileNameCharacters.append(character)
+
+    # Leading dots hide the file, Windows strips trailing dots and spaces, and some names are reserved on Windows
+    if fileNameCharacters and fileNameCharacters[0] == '.':
+        fileNameCharacters[0] = escapeFileNameCharacter('.')
+    if fileNameCharacters and fileNameCharacters[-1] in ('.', ' '):
+        fileNameCharacters[-1] = escapeFileNameCharacter(fileNameCharacters[-1])
+    if key.split('.')[0].upper() in RESERVED_FILE_NAMES and len(fileNameCharacters[0]) == 1:
+        fileNameCharacters[0] = escapeFileNameCharacter(fileNameCharacters[0])
+
+    return ''.join(fileNameCharacters)
+
+
+def fileNameToKey(fileName):
+    # fileName should not include the .json extension
+    key = urllib.parse.unquote(fileName)
+    if fileName in (keyToFileName(key), keyToFileName(key, escapeUppercase = True)):
+        return key
+    # Not a name keyToFileName() would write, so the file is from before names were escaped
+    # (eg. a key that really contains "%20"). Its name is its key.
+    return fileName
+
+
+def getAlternateFileNames(key, fileName):
+    # A key is stored as keyToFileName(key) normally, and with its uppercase characters escaped while it has a case twin.
+    # Before names were escaped it was stored under the key itself (eg. "A:B" rather than "A%3AB").
+    # Returns the names other than fileName where an earlier pull may have left the key's record.
+    candidateFileNames = [keyToFileName(key), keyToFileName(key, escapeUppercase = True)]
+    if '/' not in key and '\\' not in key: # A key with a path separator was never written as a single file
+        candidateFileNames.append(key)
+    alternateFileNames = []
+    for alternateFileName in candidateFileNames:
+        if alternateFileName != fileName and alternateFileName not in alternateFileNames:
+            alternateFileNames.append(alternateFileName)
+    return alternateFileNames
@@ -0,0 +1,198 @@
+# MIT License
+# Copyright (c) 2023 Andrew Hovey
+# Full License Text: https://ahovey.com/MITLicense.html
+# The above abbreviated copyright notice shall be included in all copies or substantial portions of the Software.
+# -----------------------------------------------------
+
+# https://github.com/ahoveynow/SalesforceUtilities/blob/main/DATA_MANAGEMENT/SOBJECT_SOURCE_CONTROL_STORE
+
+# Watches the config record folder and upserts records to the org as soon as they are saved.
+# The process stays alive between changes, so the file index, parsed records, record type ids and org session stay warm,
+# and csvs are converted in-process rather than by starting convertSourceToCsv.py for every object.
+# Accepts the same params as convertSourceToCsvAndUpsertToOrg.py, plus the ones below.
+# Deleted files are reported but not deleted from the org.
+
+# USAGE (from repo root):
+# python dataConfig/__scripts/watchConfigAndUpsertToOrg.py
+#	--orgAlias mySampleOrg
+#	--watchFolder dataConfig
+
+import os
+import time
+import util
+import convertSourceToCsvAndUpsertToOrg as upsertToOrg
+
+SMALL_SPACER = '==============='
+
+# Params
+watchFolder = 'dataConfig'		# folder to watch. Folders starting with "__" (eg. __csv, __scripts) are ignored.
+pollIntervalSeconds = 0.25		# how often the folder is checked for changes
+debounceSeconds = 0.3			# changes are pushed once no further changes have been saved for this long
+
+# Other variables
+fileIndex = {}					# json file path -> (modified time, size)
+
+
+######################
+### PROCESS PARAMS ###
+
+def processParams():
+	global watchFolder, pollIntervalSeconds, debounceSeconds
+	upsertToOrg.processParams()
+	params = util.getArgParams()
+
+	# watchFolder
+	watchFolderParam = ('watchFolder' in params.keys() and params['watchFolder'])
+	if watchFolderParam:
+		watchFolder = watchFolderParam
+	print(f'watchFolder: {watchFolder}')
+
+	# pollIntervalSeconds
+	pollIntervalSecondsParam = ('pollIntervalSeconds' in params.keys() and params['pollIntervalSeconds'])
+	if pollIntervalSecondsParam:
+		pollIntervalSeconds = parseSeconds(pollIntervalSecondsParam, 'pollIntervalSeconds')
+	print(f'pollIntervalSeconds: {pollIntervalSeconds}')
+
+	# debounceSeconds
+	debounceSecondsParam = ('debounceSeconds' in params.keys() and params['debounceSeconds'])
+	if debounceSecondsParam:
+		debounceSeconds = parseSeconds(debounceSecondsParam, 'debounceSeconds')
+	print(f'debounceSeconds: {debounceSeconds}')
+
+	print(f'\n{SMALL_SPACER}\n')
+
+
+def parseSeconds(value, paramName):
+	try:
+		return float(value)
+	except ValueError:
+		util.exitWithFailure(f'Expected a number of seconds as value for --{paramName} param.')
+
+
+
+##################
+### FILE INDEX ###
+
+def scanWatchFolder():
+	currentIndex = {}
+	folderPaths = [watchFolder]
+	while folderPaths:
+		folderPath = folderPaths.pop()
+		try:
+			entries = list(os.scandir(folderPath))
+		except FileNotFoundError:
+			continue # Folder was removed during the scan
+		for entry in entries:
+			if entry.is_dir():
+				if not entry.name.startswith('__'):
+					folderPaths.append(entry.path)
+			elif entry.name.lower().endswith('.json'):
+				try:
+					entryStat = entry.stat()
+				except FileNotFoundError:
+					continue # File was removed during the scan
+				currentIndex[os.path.relpath(entry.path, '.')] = (entryStat.st_mtime_ns, entryStat.st_size)
+	return currentIndex
+
+
+def findChanges(currentIndex):
+	changedFilePaths = set()
+	for filePath, fileState in currentIndex.items():
+		if fileIndex.get(filePath) != fileState:
+			changedFilePaths.add(filePath)
+	deletedFilePaths = set(fileIndex.keys()) - set(currentIndex.keys())
+	return changedFilePaths, deletedFilePaths
+
+
+def warmCaches():
+	global fileIndex
+	fileIndex = scanWatchFolder()
+	for filePath in fileIndex.keys():
+		try:
+			upsertToOrg.loadRecord(filePath)
+		except ValueError:
+			print(f'Skipping {filePath} (not valid json)')
+	print(f'Indexed {len(fileIndex)} records in {watchFolder}')
+
+
+
+############
+### PUSH ###
+
+def pushChanges(changedFilePaths):
+	# Returns whether every record was pushed
+	print(f'\n{SMALL_SPACER}\nPushing {len(changedFilePaths)} changed record(s)\n{SMALL_SPACER}')
+	for filePath in sorted(changedFilePaths):
+		print(filePath)
+	startTime = time.time()
+
+	upsertToOrg.resetRunState()
+	upsertToOrg.sourceFilePaths = sorted(changedFilePaths)
+	upsertToOrg.sourceFolderPaths = None
+	try:
+		upsertToOrg.convertAndUpsert()
+	except SystemExit as exception:
+		# Raised by util.exitWithFailure. Keep watching so the next save can fix the problem.
+		print(f'Push failed: {exception.code}\nWaiting for further changes...')
+		upsertToOrg.deleteTempFolder()
+		return False
+	except Exception as exception:
+		print(f'Push failed: {exception}\nWaiting for further changes...')
+		upsertToOrg.deleteTempFolder()
+		return False
+	print(f'Pushed in {time.time() - startTime:.1f} seconds. Waiting for changes...')
+	return True
+
+
+
+#############
+### WATCH ###
+
+def watch():
+	global fileIndex
+	pendingFilePaths = set()
+	failedFilePaths = set()			# Records from a push that failed. They are pushed again with the next change, since a failure can stop the push before later objects are upserted.
+	lastChangeTime = None
+	print('Waiting for changes... (Ctrl+C to stop)')
+
+	while True:
+		time.sleep(pollIntervalSeconds)
+		currentIndex = scanWatchFolder()
+		changedFilePaths, deletedFilePaths = findChanges(currentIndex)
+		fileIndex = currentIndex
+
+		for filePath in deletedFilePaths:
+			print(f'{filePath} was deleted. Records are not deleted from the org.')
+			pendingFilePaths.discard(filePath)
+			failedFilePaths.discard(filePath)
+			upsertToOrg.recordCache.pop(filePath, None)
+
+		if changedFilePaths:
+			pendingFilePaths.update(changedFilePaths)
+			lastChangeTime = time.time()
+			continue
+
+		# Push once saves have settled, so a batch of saves is sent together
+		if pendingFilePaths and time.time() - lastChangeTime >= debounceSeconds:
+			pushFilePaths = pendingFilePaths | failedFilePaths
+			failedFilePaths = set() if pushChanges(pushFilePaths) else pushFilePaths
+			pendingFilePaths = set()
+
+
+
+###############
+### EXECUTE ###
+
+def execute():
+	print('\n\n================================================\n==========   WATCH SALESFORCE CONFIG   ==========\n================================================\n')
+	processParams()
+	upsertToOrg.convertInProcess = True
+	warmCaches()
+	try:
+		watch()
+	except KeyboardInterrupt:
+		print('\nStopped watching.')
+
+
+if __name__ == '__main__':
+	execute()